@@ -0,0 +1,68 @@
+"""
+Compare Render.apply_palette with the per pixel implementation it replaced.
+
+    uv run python benchmarks/apply_palette.py
+"""
+
+import random
+import timeit
+
+from PIL import Image
+
+from model_resolver.render import Render
+
+
+def apply_palette_reference(
+    texture: Image.Image, palette: Image.Image, color_palette: Image.Image
+) -> Image.Image:
+    new_image = Image.new("RGBA", texture.size)
+    texture = texture.convert("RGBA")
+    palette = palette.convert("RGB")
+    color_palette = color_palette.convert("RGB")
+    for x in range(texture.width):
+        for y in range(texture.height):
+            pixel = texture.getpixel((x, y))
+            assert isinstance(pixel, tuple)
+            found = False
+            for i in range(palette.width):
+                for j in range(palette.height):
+                    if palette.getpixel((i, j)) == pixel[:3]:
+                        new_color = color_palette.getpixel((i, j))
+                        assert isinstance(new_color, tuple)
+                        new_image.putpixel((x, y), new_color + (pixel[3],))
+                        found = True
+                        break
+                if found:
+                    break
+            if not found:
+                new_image.putpixel((x, y), pixel)
+    return new_image
+
+
+def random_image(mode: str, size: tuple[int, int], colors: list[tuple[int, ...]], rng: random.Random):
+    img = Image.new(mode, size)
+    img.putdata([rng.choice(colors) for _ in range(size[0] * size[1])])
+    return img
+
+
+def main():
+    rng = random.Random(0)
+    grays = [(v, v, v) for v in range(0, 256, 16)]
+    # an armor trim like setup: 8 palette colors, some texture pixels outside of the palette
+    palette = random_image("RGB", (8, 1), grays[:8], rng)
+    color_palette = random_image("RGB", (8, 1), [(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(8)], rng)
+    texture = random_image("RGBA", (64, 32), [(*gray, alpha) for gray in grays for alpha in (0, 255)], rng)
+
+    expected = apply_palette_reference(texture, palette, color_palette)
+    assert Render.apply_palette(texture, palette, color_palette).tobytes() == expected.tobytes()
+
+    number = 5
+    reference = timeit.timeit(lambda: apply_palette_reference(texture, palette, color_palette), number=number) / number
+    vectorized = timeit.timeit(lambda: Render.apply_palette(texture, palette, color_palette), number=number * 100) / (number * 100)
+    print(f"reference:  {reference * 1000:8.3f} ms")
+    print(f"vectorized: {vectorized * 1000:8.3f} ms")
+    print(f"speedup:    {reference / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Parse every vanilla item model with the discriminator dispatch, then with the
+trial and error validation it replaced.
+
+    uv run python benchmarks/item_models.py
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from beet import run_beet
+from beet.contrib.vanilla import Vanilla
+from pydantic import BaseModel
+
+from model_resolver.item_model import model, special
+from model_resolver.item_model.model import ItemModel, ItemModelRecursive
+from model_resolver.item_model.special import SpecialModel
+
+
+@dataclass
+class TrialIndex:
+    """Every registered class is a candidate, last registered first."""
+
+    classes: list[Any]
+
+    def get_candidates(self, data: Any) -> list[Any]:
+        return list(reversed(self.classes))
+
+
+def walk(value: Any):
+    """Nested item models and special models are only parsed when accessed."""
+    if isinstance(value, ItemModelRecursive):
+        walk(value.model)
+    elif isinstance(value, SpecialModel):
+        walk(value.special_model)
+    elif isinstance(value, BaseModel):
+        for name in type(value).model_fields:
+            walk(getattr(value, name))
+    elif isinstance(value, (list, tuple)):
+        for x in value:
+            walk(x)
+    elif isinstance(value, dict):
+        for x in value.values():
+            walk(x)
+
+
+def parse_all(item_models: list[Any]) -> float:
+    start = time.perf_counter()
+    for data in item_models:
+        walk(ItemModel.model_validate(data))
+    return time.perf_counter() - start
+
+
+def main():
+    with run_beet(cache=True) as ctx:
+        assets = Vanilla(ctx).mount("assets/minecraft/items").assets
+        item_models = [item_model.data for item_model in assets.item_models.values()]
+
+    dispatch = parse_all(item_models)
+
+    indexes = model.ItemModelBaseIndex, special.SpecialModelBaseIndex
+    model.ItemModelBaseIndex = TrialIndex(model.ItemModelBaseClass)  # type: ignore
+    special.SpecialModelBaseIndex = TrialIndex(special.SpecialModelBaseClass)  # type: ignore
+    try:
+        reference = parse_all(item_models)
+    finally:
+        model.ItemModelBaseIndex, special.SpecialModelBaseIndex = indexes
+
+    count = len(item_models)
+    print(f"{count} item models")
+    print(f"trial and error: {reference / count * 1e6:8.1f} us per item model")
+    print(f"dispatch:        {dispatch / count * 1e6:8.1f} us per item model")
+    print(f"speedup:         {reference / dispatch:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
-from typing import Any, ClassVar, Generator, Literal, Union, Optional
+from functools import cached_property
+import math
+from typing import Any, Callable, ClassVar, Generator, Literal, Union, Optional
 from beet import NamespaceFile, NamespaceProxy, TagFile
 from pydantic import AliasChoices, Field, RootModel, BaseModel
-from nbtlib import parse_nbt, Compound
+from nbtlib import parse_nbt
 
 from model_resolver.item_model.item import Item
 from model_resolver.utils import resolve_key
@@ -15,6 +17,8 @@ class MinMax(BaseModel):
 
 type NumberOrRange = Union[int, MinMax, None]
 type TaggedID = str | list[str] | None
+# Component values satisfying a predicate, by path: the component then the keys inside of it
+type PredicatePatch = dict[tuple[str | int, ...], Any]
 
 
 def compare_range(predicate: NumberOrRange, value: Any) -> bool:
@@ -25,6 +29,24 @@ def compare_range(predicate: NumberOrRange, value: Any) -> bool:
     return False
 
 
+def range_example(predicate: NumberOrRange) -> Optional[int]:
+    """A value in the range, None when no value compares equal."""
+    if isinstance(predicate, int):
+        return predicate
+    if isinstance(predicate, MinMax):
+        return math.ceil(predicate.min)
+    return None
+
+
+def first_id(value: TaggedID) -> Optional[str]:
+    """An id of a tagged id known without the packs, tags are skipped."""
+    if isinstance(value, str):
+        return None if value.startswith("#") else resolve_key(value)
+    if isinstance(value, list):
+        return next((x for x in map(first_id, value) if x is not None), None)
+    return None
+
+
 def iter_tagged_id[
     T: NamespaceFile
 ](value: TaggedID, proxy: NamespaceProxy[T] | None = None) -> Generator[
@@ -57,11 +79,34 @@ def iter_tagged_id[
         raise TypeError(f"Invalid tagged id type {value}")
 
 
+def get_tagged_ids(
+    value: TaggedID, getter: PackGetter | None = None, tags: str | None = None
+) -> frozenset[str]:
+    """
+    All the ids of a tagged id, `tags` being the data pack attribute holding the tags
+    of the registry. Each tag is flattened once, until the tags of the packs change.
+    """
+    if isinstance(value, list):
+        return frozenset().union(*(get_tagged_ids(x, getter, tags) for x in value))
+    if isinstance(value, str) and value.startswith("#") and getter and tags:
+        key = (tags, resolve_key(value[1:]))
+        ids = getter.tag_index.get(key)
+        if ids is None:
+            ids = frozenset(iter_tagged_id(value, getattr(getter.data, tags)))
+            getter.tag_index[key] = ids
+        return ids
+    return frozenset(iter_tagged_id(value))
+
+
 class DataComponentBase(BaseModel):
 
     def is_valid(self, getter: PackGetter, item: Item) -> bool | None:
         return False
 
+    def component_patch(self) -> Optional[PredicatePatch]:
+        """Component values satisfying the predicate, None when they can't be built."""
+        return None
+
 
 class AttributeModifier(BaseModel):
     attribute: TaggedID = None
@@ -132,8 +177,8 @@ class InventoryLikeDataComponent(DataComponentBase):
         res = 0
         for item in container:
             if item_condition.items is not None:
-                if resolve_key(item.id) not in iter_tagged_id(
-                    item_condition.items, getter.data.item_tags
+                if resolve_key(item.id) not in get_tagged_ids(
+                    item_condition.items, getter, "item_tags"
                 ):
                     continue
             if item_condition.count is not None:
@@ -182,6 +227,12 @@ class ContainerDataComponent(InventoryLikeDataComponent):
 class CustomDataDataComponent(RootModel, DataComponentBase):
     root: dict[str, Any] | str
 
+    @cached_property
+    def nbt(self) -> dict[str, Any]:
+        if isinstance(self.root, str):
+            return parse_nbt(self.root)
+        return self.root
+
     def verify_equal(
         self, predicate: dict[str, Any] | list[dict[str, Any]] | int | str, value: Any
     ) -> bool:
@@ -209,11 +260,10 @@ class CustomDataDataComponent(RootModel, DataComponentBase):
             return False
         if not isinstance(custom_data, dict):
             return False
-        if isinstance(self.root, str):
-            nbt: Compound = parse_nbt(self.root)
-            a = self.verify_equal(nbt, custom_data)
-            return a
-        return self.verify_equal(self.root, custom_data)
+        return self.verify_equal(self.nbt, custom_data)
+
+    def component_patch(self) -> Optional[PredicatePatch]:
+        return {("minecraft:custom_data",): self.nbt}
 
 
 class DamageDataComponent(DataComponentBase):
@@ -232,19 +282,25 @@ class DamageDataComponent(DataComponentBase):
             self.damage, damage
         )
 
+    def component_patch(self) -> Optional[PredicatePatch]:
+        damage = range_example(self.damage)
+        durability = range_example(self.durability)
+        if damage is None or durability is None:
+            return None
+        return {
+            ("minecraft:damage",): damage,
+            ("minecraft:max_damage",): damage + durability,
+        }
+
 
 class Enchantment(BaseModel):
     enchantments: TaggedID = None
     levels: NumberOrRange = None
 
     def is_valid(self, enchantments: dict[str, int], getter: PackGetter) -> bool:
-        enchantments = {resolve_key(key): value for key, value in enchantments.items()}
-        for enchantment in iter_tagged_id(
-            self.enchantments, getter.data.enchantment_tags
-        ):
-            if enchantment not in enchantments:
-                continue
-            if compare_range(self.levels, enchantments[enchantment]):
+        ids = get_tagged_ids(self.enchantments, getter, "enchantment_tags")
+        for enchantment, level in enchantments.items():
+            if resolve_key(enchantment) in ids and compare_range(self.levels, level):
                 return True
         return False
 
@@ -267,11 +323,26 @@ class EnchantmentsLikeDataComponent(RootModel, DataComponentBase):
                 return False
         return True
 
+    def enchantments_patch(self, component_name: str) -> Optional[PredicatePatch]:
+        if not self.root:
+            return None
+        patch: PredicatePatch = {}
+        for predicate_enchantment in self.root:
+            enchantment = first_id(predicate_enchantment.enchantments)
+            level = range_example(predicate_enchantment.levels)
+            if enchantment is None or level is None:
+                return None
+            patch[(component_name, enchantment)] = level
+        return patch
+
 
 class EnchantmentsDataComponent(EnchantmentsLikeDataComponent):
     def is_valid(self, getter: PackGetter, item: Item) -> bool:
         return self.is_valid_enchantments(getter, item, "enchantments")
 
+    def component_patch(self) -> Optional[PredicatePatch]:
+        return self.enchantments_patch("minecraft:enchantments")
+
 
 class FireworkExplosionDataComponent(DataComponentBase): ...
 
@@ -286,10 +357,17 @@ class JukeboxPlayableDataComponent(RootModel, DataComponentBase):
         jukebox_playable = item.get("jukebox_playable")
         if jukebox_playable is None:
             return False
-        for sound in iter_tagged_id(self.root):
-            if resolve_key(sound) == resolve_key(jukebox_playable):
-                return True
-        return False
+        return resolve_key(jukebox_playable) in self.sounds
+
+    @cached_property
+    def sounds(self) -> frozenset[str]:
+        return get_tagged_ids(self.root)
+
+    def component_patch(self) -> Optional[PredicatePatch]:
+        sound = first_id(self.root)
+        if sound is None:
+            return None
+        return {("minecraft:jukebox_playable",): sound}
 
 
 class PotionContentsDataComponent(DataComponentBase):
@@ -302,17 +380,26 @@ class PotionContentsDataComponent(DataComponentBase):
         potion_type = potion.get("potion")
         if potion_type is None:
             return False
-        potion_type = resolve_key(potion_type)
-        for predicate_potion_type in iter_tagged_id(self.root):
-            if potion_type == predicate_potion_type:
-                return True
-        return False
+        return resolve_key(potion_type) in self.potions
+
+    @cached_property
+    def potions(self) -> frozenset[str]:
+        return get_tagged_ids(self.root)
+
+    def component_patch(self) -> Optional[PredicatePatch]:
+        potion = first_id(self.root)
+        if potion is None:
+            return None
+        return {("minecraft:potion_contents", "potion"): potion}
 
 
 class StoredEnchantmentsDataComponent(EnchantmentsLikeDataComponent):
     def is_valid(self, getter: PackGetter, item: Item) -> bool:
         return self.is_valid_enchantments(getter, item, "stored_enchantments")
 
+    def component_patch(self) -> Optional[PredicatePatch]:
+        return self.enchantments_patch("minecraft:stored_enchantments")
+
 
 class TrimDataComponent(DataComponentBase):
     material: TaggedID = None
@@ -326,24 +413,34 @@ class TrimDataComponent(DataComponentBase):
             material = trim.get("material")
             if material is None:
                 return False
-            material = resolve_key(material)
-            if not any(
-                material == predicate_material
-                for predicate_material in iter_tagged_id(self.material)
-            ):
+            if resolve_key(material) not in self.materials:
                 return False
         if self.pattern is not None:
             pattern = trim.get("pattern")
             if pattern is None:
                 return False
-            pattern = resolve_key(pattern)
-            if not any(
-                pattern == predicate_pattern
-                for predicate_pattern in iter_tagged_id(self.pattern)
-            ):
+            if resolve_key(pattern) not in self.patterns:
                 return False
         return True
 
+    @cached_property
+    def materials(self) -> frozenset[str]:
+        return get_tagged_ids(self.material)
+
+    @cached_property
+    def patterns(self) -> frozenset[str]:
+        return get_tagged_ids(self.pattern)
+
+    def component_patch(self) -> Optional[PredicatePatch]:
+        patch: PredicatePatch = {}
+        for key, value in (("material", self.material), ("pattern", self.pattern)):
+            if value is None:
+                continue
+            if (value_id := first_id(value)) is None:
+                return None
+            patch[("minecraft:trim", key)] = value_id
+        return patch or {("minecraft:trim",): {}}
+
 
 class WritableBookContentDataComponent(DataComponentBase): ...
 
@@ -409,26 +506,53 @@ class DataComponent(BaseModel):
         ),
     )
 
-    def is_valid(self, getter: PackGetter, item: Item) -> bool:
-        valid = []
-        components: list[Optional[DataComponentBase]] = [
-            self.attibute_modifiers,
-            self.bundle_contents,
-            self.container,
-            self.custom_data,
-            self.damage,
-            self.enchantments,
-            self.firework_explosion,
-            self.fireworks,
-            self.jukebox_playable,
-            self.potion_contents,
-            self.stored_enchantments,
-            self.trim,
-            self.writable_book_content,
+    def get_components(self) -> list[DataComponentBase]:
+        """The component predicates set."""
+        return [
+            component
+            for component in (
+                self.attibute_modifiers,
+                self.bundle_contents,
+                self.container,
+                self.custom_data,
+                self.damage,
+                self.enchantments,
+                self.firework_explosion,
+                self.fireworks,
+                self.jukebox_playable,
+                self.potion_contents,
+                self.stored_enchantments,
+                self.trim,
+                self.writable_book_content,
+            )
+            if component is not None
         ]
 
-        for component in components:
-            if component is None:
-                continue
-            valid.append(component.is_valid(getter, item))
-        return all(valid)
+    def compile(self) -> Callable[[PackGetter, Item], bool]:
+        """
+        The predicate as a callable, testing only the given components
+        and stopping at the first one failing.
+        """
+        components = self.get_components()
+
+        def predicate(getter: PackGetter, item: Item) -> bool:
+            return all(component.is_valid(getter, item) for component in components)
+
+        return predicate
+
+    @cached_property
+    def predicate(self) -> Callable[[PackGetter, Item], bool]:
+        return self.compile()
+
+    def is_valid(self, getter: PackGetter, item: Item) -> bool:
+        return self.predicate(getter, item)
+
+    def component_patch(self) -> Optional[PredicatePatch]:
+        """Component values satisfying every component predicate, None when they can't be built."""
+        patch: PredicatePatch = {}
+        for component in self.get_components():
+            component_patch = component.component_patch()
+            if component_patch is None:
+                return None
+            patch.update(component_patch)
+        return patch
@@ -1,9 +1,34 @@
-from pydantic import BaseModel, Field
-from typing import Any, Self
+import hashlib
+import json
+from copy import deepcopy
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
+from typing import Any, Mapping, Optional, Self
 from beet import Context
 from model_resolver.utils import get_default_components, resolve_key
 
 
+class FrozenComponents(dict[str, Any]):
+    """
+    Components of an item, read only so that the merged components cached on the item
+    stay up to date: assign a new dict to change them. Copies are regular dicts.
+    """
+
+    def _read_only(self, *args: Any, **kwargs: Any):
+        raise TypeError("Item components are read only, assign a new dict instead")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only  # type: ignore
+
+    def __copy__(self) -> dict[str, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> dict[str, Any]:
+        return deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return FrozenComponents, (dict(self),)
+
+
 class Item(BaseModel):
     id: str
     count: int = 1
@@ -14,6 +39,15 @@ class Item(BaseModel):
 
     __resolved__: bool = False
 
+    @field_validator("components_from_user", "default_components", mode="after")
+    @classmethod
+    def freeze_components(cls, value: dict[str, Any]) -> dict[str, Any]:
+        return value if isinstance(value, FrozenComponents) else FrozenComponents(value)
+
+    # merged components, with the dicts they were merged from
+    _components: Optional[tuple[dict[str, Any], dict[str, Any], Mapping[str, Any]]] = PrivateAttr(default=None)
+    _fingerprint: Optional[tuple[str, int, Mapping[str, Any], str]] = PrivateAttr(default=None)
+
     def fill(self, ctx: Context) -> Self:
         if self.__resolved__:
             return self
@@ -25,10 +59,153 @@ class Item(BaseModel):
         return self
 
     @property
-    def components(self) -> dict[str, Any]:
-        return {**self.default_components, **self.components_from_user}
+    def components(self) -> Mapping[str, Any]:
+        """The default components overridden by the user ones, read only, merged again when they change."""
+        default_components = self.get_frozen("default_components")
+        components_from_user = self.get_frozen("components_from_user")
+        cached = self._components
+        if (
+            cached is None
+            or cached[0] is not default_components
+            or cached[1] is not components_from_user
+        ):
+            merged = FrozenComponents({**default_components, **components_from_user})
+            cached = self._components = (default_components, components_from_user, merged)
+        return cached[2]
+
+    def get_frozen(self, name: str) -> dict[str, Any]:
+        """A component dict, frozen when it was assigned without validation."""
+        value = self.__dict__[name]
+        if not isinstance(value, FrozenComponents):
+            value = self.__dict__[name] = FrozenComponents(value)
+        return value
+
+    @property
+    def components_fingerprint(self) -> str:
+        """Identifies the id, count and components of the item, stable across sessions."""
+        components = self.components
+        cached = self._fingerprint
+        if (
+            cached is None
+            or cached[0] != self.id
+            or cached[1] != self.count
+            or cached[2] is not components
+        ):
+            data = json.dumps([self.id, self.count, dict(components)], sort_keys=True, default=repr)
+            fingerprint = hashlib.sha256(data.encode()).hexdigest()
+            cached = self._fingerprint = (self.id, self.count, components, fingerprint)
+        return cached[3]
 
     def get(self, component_name: str) -> Any:
         key = resolve_key(component_name)
         namespace, path = key.split(":", 1)
         return self.components.get(key, self.components.get(path, None))
+
+
+class RecordingDict(dict[str, Any]):
+    """Components recording which of them are read."""
+
+    def __init__(self, components: dict[str, Any], reads: set[tuple[str, str]], kind: str):
+        super().__init__(components)
+        self.reads = reads
+        self.kind = kind
+
+    def __getitem__(self, key: str) -> Any:
+        self.reads.add((self.kind, key))
+        return super().__getitem__(key)
+
+    def __contains__(self, key: object) -> bool:
+        self.reads.add((self.kind, str(key)))
+        return super().__contains__(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self.reads.add((self.kind, key))
+        return super().get(key, default)
+
+    def __bool__(self) -> bool:
+        self.reads.add((self.kind, "#empty"))
+        return super().__len__() > 0
+
+    def __len__(self) -> int:
+        self.reads.add((self.kind, "#len"))
+        return super().__len__()
+
+    def __iter__(self):
+        self.reads.add((self.kind, "#all"))
+        return super().__iter__()
+
+    def keys(self):
+        self.reads.add((self.kind, "#all"))
+        return super().keys()
+
+    def values(self):
+        self.reads.add((self.kind, "#all"))
+        return super().values()
+
+    def items(self):
+        self.reads.add((self.kind, "#all"))
+        return super().items()
+
+    def __eq__(self, other: object) -> bool:
+        self.reads.add((self.kind, "#all"))
+        return super().__eq__(other)
+
+    __hash__ = None  # type: ignore
+
+
+class RecordingItem(Item):
+    """
+    An item recording the components read from it, so that a result computed
+    from it can be reused for items with the same values for these components.
+    The id and the count are always considered read.
+    """
+
+    _reads: set[tuple[str, str]] = PrivateAttr(default_factory=set)
+    _user_components: dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def record(cls, item: Item) -> Self:
+        recording = cls.model_construct(
+            id=item.id,
+            count=item.count,
+            components=item.components_from_user,
+            default_components=item.default_components,
+        )
+        recording.__resolved__ = item.__resolved__
+        recording._user_components = item.components_from_user
+        recording.components_from_user = RecordingDict(
+            item.components_from_user, recording._reads, "user"
+        )
+        return recording
+
+    @property
+    def components(self) -> dict[str, Any]:
+        return RecordingDict(
+            {**self.default_components, **self._user_components},
+            self._reads,
+            "component",
+        )
+
+    @property
+    def reads(self) -> tuple[tuple[str, str], ...]:
+        return tuple(sorted(self._reads))
+
+    @staticmethod
+    def fingerprint(item: Item, reads: tuple[tuple[str, str], ...]) -> str:
+        """The values of the given reads for an item."""
+        sources: dict[str, Mapping[str, Any]] = {
+            "component": item.components,
+            "user": item.components_from_user,
+        }
+        values: list[Any] = [item.id, item.count]
+        for kind, key in reads:
+            components = sources[kind]
+            if key == "#all":
+                values.append(dict(components))
+            elif key == "#empty":
+                values.append(len(components) == 0)
+            elif key == "#len":
+                values.append(len(components))
+            else:
+                values.append((key in components, components.get(key)))
+        return json.dumps(values, sort_keys=True, default=repr)
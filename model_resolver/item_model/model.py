@@ -1,16 +1,28 @@
+from copy import deepcopy
 from functools import cached_property
+from itertools import product
+import hashlib
+import json
 from pydantic import BaseModel, Field, RootModel, ValidationError
 from model_resolver.item_model.data_component_predicate import DataComponent
 from model_resolver.item_model.tint_source import TintSource
 from model_resolver.item_model.special import SpecialModel
-from typing import Optional, Literal, ClassVar, Generator, Type, Union, Any
-from model_resolver.item_model.item import Item
+from typing import Callable, Optional, Literal, ClassVar, Generator, Type, Union, Any
+from model_resolver.item_model.item import Item, RecordingItem
 from model_resolver.item_model.transformation import Transformation
-from model_resolver.utils import ModelResolverOptions, clamp, resolve_key
+from model_resolver.utils import DiscriminatorIndex, ModelResolverOptions, clamp, log, resolve_key
 from model_resolver.minecraft_model import MinecraftModel, resolve_model
 from model_resolver.pack_getter import PackGetter
 
 ItemModelBaseClass: list[Type["ItemModelBase"]] = []
+# Component values selecting a branch, by path: the component then the keys inside of it
+type ComponentPatch = dict[tuple[str | int, ...], Any]
+# Value of the missing entries of a list set by a patch, by list name
+PATCH_LIST_PADDING: dict[str, Any] = {"flags": False, "floats": 0.0, "strings": "", "colors": 0}
+# item models are dispatched on their type and property
+ItemModelBaseIndex: DiscriminatorIndex["ItemModelBase"] = DiscriminatorIndex(
+    ItemModelBaseClass, ("type", "property")
+)
 
 
 class ItemModelBase(BaseModel):
@@ -39,6 +51,24 @@ class ItemModelBase(BaseModel):
     ) -> Generator["ItemModelResolvable", None, None]:
         yield from []
 
+    def iter_branches(
+        self,
+    ) -> Generator[tuple[ComponentPatch, "ItemModelRecursive"], None, None]:
+        """Children of the node, with the component values selecting them when they are known."""
+        yield from []
+
+    def iter_patches(self) -> Generator[ComponentPatch, None, None]:
+        """Component values selecting each reachable leaf below the node."""
+        is_leaf = True
+        for patch, child in self.iter_branches():
+            is_leaf = False
+            for child_patch in child.iter_patches():
+                merged = merge_patches(patch, child_patch)
+                if merged is not None:
+                    yield merged
+        if is_leaf:
+            yield {}
+
     def __init_subclass__(cls, **kwargs):
         # not in the list, not this base class and not any base class
         if (
@@ -55,13 +85,14 @@ class ItemModelBase(BaseModel):
     
 
     def with_compose(self, parent_transformation: Optional[Transformation]):
+        # parsed item models are shared, the composed leaf is a copy
         if parent_transformation is None:
             return self
         if self.transformation is None:
-            self.transformation = parent_transformation
-            return self
-        self.transformation = parent_transformation.compose(self.transformation)
-        return self
+            return self.model_copy(update={"transformation": parent_transformation})
+        return self.model_copy(
+            update={"transformation": parent_transformation.compose(self.transformation)}
+        )
 
 
 class ItemModelModel(ItemModelBase):
@@ -96,6 +127,15 @@ class ItemModelComposite(ItemModelBase):
         for model in self.models:
             yield from model.resolve_with_compose(getter, item, self.transformation)
 
+    def iter_patches(self) -> Generator[ComponentPatch, None, None]:
+        for patches in product(*(list(model.iter_patches()) for model in self.models)):
+            merged: Optional[ComponentPatch] = {}
+            for patch in patches:
+                if merged is not None:
+                    merged = merge_patches(merged, patch)
+            if merged is not None:
+                yield merged
+
 
 class ItemModelConditionBase(ItemModelBase):
     type: Literal["minecraft:condition", "condition"]
@@ -131,6 +171,15 @@ class ItemModelConditionBase(ItemModelBase):
     def resolve_condition(self, getter: PackGetter, item: Item) -> bool:
         raise NotImplementedError
 
+    def condition_patch(self) -> Optional[ComponentPatch]:
+        return None
+
+    def iter_branches(
+        self,
+    ) -> Generator[tuple[ComponentPatch, "ItemModelRecursive"], None, None]:
+        yield self.condition_patch() or {}, self.on_true
+        yield {}, self.on_false
+
     def resolve(
         self, getter: PackGetter, item: Item
     ) -> Generator["ItemModelResolvable", None, None]:
@@ -170,9 +219,42 @@ class ItemModelConditionComponent(ItemModelConditionBase):
     predicate: str
     value: Any
 
+    @cached_property
+    def data_component(self) -> DataComponent:
+        return DataComponent.model_validate({self.predicate: self.value})
+
+    @cached_property
+    def compiled_predicate(self) -> Callable[[PackGetter, Item], bool]:
+        """The predicate compiled once for the node."""
+        return self.data_component.compile()
+
     def resolve_condition(self, getter: PackGetter, item: Item) -> bool:
-        data_component = DataComponent.model_validate({self.predicate: self.value})
-        return data_component.is_valid(getter, item) or False
+        return self.compiled_predicate(getter, item) or False
+
+    def condition_patch(self) -> Optional[ComponentPatch]:
+        try:
+            patch = self.data_component.component_patch()
+            if patch is None:
+                return None
+            # the patch only counts when it satisfies the predicate on its own
+            item = Item(id="minecraft:air", components=apply_component_patch({}, patch))
+            if self.compiled_predicate(None, item):  # type: ignore
+                return patch
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return None
+
+    def iter_branches(
+        self,
+    ) -> Generator[tuple[ComponentPatch, "ItemModelRecursive"], None, None]:
+        patch = self.condition_patch()
+        if patch is None:
+            log.warning(
+                f"No component values known to match the {self.predicate} predicate {self.value}, skipping its on_true branch"
+            )
+        else:
+            yield patch, self.on_true
+        yield {}, self.on_false
 
 
 class ItemModelConditionDamaged(ItemModelConditionBase):
@@ -185,6 +267,9 @@ class ItemModelConditionDamaged(ItemModelConditionBase):
             return False
         return item.components["minecraft:damage"] > 0
 
+    def condition_patch(self) -> Optional[ComponentPatch]:
+        return {("minecraft:damage",): 1}
+
 
 class ItemModelConditionHasComponent(ItemModelConditionBase):
     property: Literal["minecraft:has_component", "has_component"]
@@ -199,6 +284,9 @@ class ItemModelConditionHasComponent(ItemModelConditionBase):
         else:
             return self.component in item.components
 
+    def condition_patch(self) -> Optional[ComponentPatch]:
+        return {(self.component,): {}}
+
 
 class ItemModelConditionFishingRodCast(ItemModelConditionBase):
     property: Literal["minecraft:fishing_rod/cast", "fishing_rod/cast"]
@@ -265,6 +353,9 @@ class ItemModelConditionCustomModelData(ItemModelConditionBase):
             return False
         return item.components["minecraft:custom_model_data"]["flags"][index]
 
+    def condition_patch(self) -> Optional[ComponentPatch]:
+        return {("minecraft:custom_model_data", "flags", self.index or 0): True}
+
 
 class ItemModelConditionViewEntity(ItemModelConditionBase):
     property: Literal["minecraft:view_entity", "view_entity"]
@@ -325,6 +416,17 @@ class ItemModelSelectBase(ItemModelBase):
     ) -> Generator["ItemModelResolvable", None, None]:
         yield from self.resolve_select(getter, item).resolve_with_compose(getter, item, self.transformation)
 
+    def case_patch(self, value: Any) -> Optional[ComponentPatch]:
+        return None
+
+    def iter_branches(
+        self,
+    ) -> Generator[tuple[ComponentPatch, "ItemModelRecursive"], None, None]:
+        for case in self.cases:
+            for value in case.when if isinstance(case.when, list) else [case.when]:
+                yield self.case_patch(value) or {}, case.model
+        yield {}, self.fallback
+
 
 class ItemModelSelectMainHand(ItemModelSelectBase):
     property: Literal["minecraft:main_hand", "main_hand"]
@@ -361,6 +463,9 @@ class ItemModelSelectComponent(ItemModelSelectBase):
             return self.resolve_case(component)
         return self.fallback
 
+    def case_patch(self, value: Any) -> Optional[ComponentPatch]:
+        return {(resolve_key(self.component),): value}
+
 
 class ItemModelSelectLocalTime(ItemModelSelectBase):
     property: Literal["minecraft:local_time", "local_time"]
@@ -392,6 +497,9 @@ class ItemModelSelectTrimMaterial(ItemModelSelectBase):
             return self.fallback
         return self.resolve_case(item.components["minecraft:trim"]["material"])
 
+    def case_patch(self, value: Any) -> Optional[ComponentPatch]:
+        return {("minecraft:trim", "material"): value}
+
 
 class ItemModelSelectBlockState(ItemModelSelectBase):
     property: Literal["minecraft:block_state", "block_state"]
@@ -408,6 +516,9 @@ class ItemModelSelectBlockState(ItemModelSelectBase):
             item.components["minecraft:block_state"][self.block_state_property]
         )
 
+    def case_patch(self, value: Any) -> Optional[ComponentPatch]:
+        return {("minecraft:block_state", self.block_state_property): value}
+
 
 class ItemModelSelectDisplayContext(ItemModelSelectBase):
     property: Literal["minecraft:display_context", "display_context"]
@@ -445,6 +556,9 @@ class ItemModelSelectCustomModelData(ItemModelSelectBase):
             item.components["minecraft:custom_model_data"]["strings"][index]
         )
 
+    def case_patch(self, value: Any) -> Optional[ComponentPatch]:
+        return {("minecraft:custom_model_data", "strings", self.index or 0): value}
+
 
 class ItemModelSelectContextDimension(ItemModelSelectBase):
     property: Literal["minecraft:context_dimension", "context_dimension"]
@@ -506,6 +620,17 @@ class ItemModelRangeDispatchBase(ItemModelBase):
         if self.fallback:
             yield from self.fallback.resolve_with_compose(getter, item, self.transformation)
 
+    def threshold_patch(self, threshold: float) -> Optional[ComponentPatch]:
+        return None
+
+    def iter_branches(
+        self,
+    ) -> Generator[tuple[ComponentPatch, "ItemModelRecursive"], None, None]:
+        for entry in self.entries:
+            yield self.threshold_patch(entry.threshold) or {}, entry.model
+        if self.fallback:
+            yield {}, self.fallback
+
 
 class ItemModelRangeDispatchCustomModelData(ItemModelRangeDispatchBase):
     property: Literal["minecraft:custom_model_data", "custom_model_data"]
@@ -523,6 +648,9 @@ class ItemModelRangeDispatchCustomModelData(ItemModelRangeDispatchBase):
             return 0.0
         return item.components["minecraft:custom_model_data"]["floats"][index]
 
+    def threshold_patch(self, threshold: float) -> Optional[ComponentPatch]:
+        return {("minecraft:custom_model_data", "floats", self.index or 0): threshold}
+
 
 class ItemModelRangeDispatchBundleFullness(ItemModelRangeDispatchBase):
     property: Literal["minecraft:bundle/fullness", "bundle/fullness"]
@@ -691,6 +819,8 @@ class ItemModelEmpty(ItemModelBase):
 
 
 type ItemModelResolvable = Union[ItemModelModel, ItemModelSpecial]
+# A baked model to render, with its tints and its composed transformation
+type ResolvedLeaf = tuple[MinecraftModel, list[TintSource], Optional[Transformation]]
 
 
 class ItemModelRecursive(RootModel[Any]):
@@ -698,13 +828,15 @@ class ItemModelRecursive(RootModel[Any]):
 
     @cached_property
     def model(self) -> ItemModelBase:
-        errors = []
-        for cls in reversed(ItemModelBaseClass):
+        errors: list[ValidationError] = []
+        for cls in ItemModelBaseIndex.get_candidates(self.root):
             try:
                 return cls.model_validate(self.root)
             except ValidationError as e:
                 errors.append(e)
-        raise ValidationError(errors)
+        if len(errors) > 0:
+            raise errors[0]
+        raise ValueError(f"No item model found for {self.root}")
 
     def resolve(
         self, getter: PackGetter, item: Item
@@ -714,6 +846,9 @@ class ItemModelRecursive(RootModel[Any]):
     def resolve_with_compose(self, getter: PackGetter, item: Item, parent_transformation: Optional[Transformation]) -> Generator["ItemModelResolvable", None, None]:
         yield from self.model.resolve_with_compose(getter, item, parent_transformation)
 
+    def iter_patches(self) -> Generator[ComponentPatch, None, None]:
+        yield from self.model.iter_patches()
+
 
 class ItemModel(BaseModel):
     model: ItemModelRecursive
@@ -724,3 +859,107 @@ class ItemModel(BaseModel):
         self, getter: PackGetter, item: Item
     ) -> Generator["ItemModelResolvable", None, None]:
         yield from self.model.resolve(getter, item)
+
+    def iter_patches(self) -> Generator[ComponentPatch, None, None]:
+        """Component values selecting each reachable leaf of the tree, once each."""
+        seen: set[str] = set()
+        for patch in self.model.iter_patches():
+            key = json.dumps(
+                sorted((repr(path), value) for path, value in patch.items()),
+                default=repr,
+            )
+            if key not in seen:
+                seen.add(key)
+                yield patch
+
+    def get_leaves(self, getter: PackGetter, item: Item) -> list[ResolvedLeaf]:
+        return [
+            (
+                model.get_model(getter, item).bake(),
+                model.get_tints(getter, item),
+                model.transformation,
+            )
+            for model in self.resolve(getter, item)
+        ]
+
+    @classmethod
+    def from_key(cls, getter: PackGetter, key: str) -> Optional["ItemModel"]:
+        """Item models are parsed once per session, until their file changes."""
+        item_model_file = getter.assets.item_models.get(key)
+        if item_model_file is None:
+            return None
+        cached = getter.parsed_item_models.get(key)
+        if cached is not None and cached[0] is item_model_file:
+            return cached[1]
+        item_model = cls.model_validate(item_model_file.data)
+        getter.parsed_item_models[key] = (item_model_file, item_model)
+        getter.resolved_item_models.pop(key, None)
+        return item_model
+
+
+def resolve_item_model(
+    getter: PackGetter, key: str, item: Item
+) -> Optional[list[ResolvedLeaf]]:
+    """
+    The leaves of an item model for an item, memoized by the values of the components
+    read while resolving it: items agreeing on them resolve to the same leaves.
+    """
+    item_model = ItemModel.from_key(getter, key)
+    if item_model is None:
+        return None
+    memo = getter.resolved_item_models.setdefault(key, {})
+    for reads, leaves_by_values in memo.items():
+        leaves = leaves_by_values.get(RecordingItem.fingerprint(item, reads))
+        if leaves is not None:
+            return leaves
+    recording = RecordingItem.record(item)
+    leaves = item_model.get_leaves(getter, recording)
+    reads = recording.reads
+    memo.setdefault(reads, {})[RecordingItem.fingerprint(item, reads)] = leaves
+    return leaves
+
+
+def merge_patches(
+    patch: ComponentPatch, other: ComponentPatch
+) -> Optional[ComponentPatch]:
+    """Both patches, or None when they need different values for the same path."""
+    merged = dict(patch)
+    for path, value in other.items():
+        if path in merged and merged[path] != value:
+            return None
+        merged[path] = value
+    return merged
+
+
+def apply_component_patch(
+    components: dict[str, Any], patch: ComponentPatch
+) -> dict[str, Any]:
+    """A copy of the components with the values of the patch, missing list entries are padded."""
+    res = deepcopy(components)
+    for path, value in patch.items():
+        container: Any = res
+        for key, next_key in zip(path, path[1:]):
+            default = [] if isinstance(next_key, int) else {}
+            if not isinstance(container.get(key), type(default)):
+                container[key] = default
+            container = container[key]
+        key = path[-1]
+        if isinstance(key, int):
+            padding = PATCH_LIST_PADDING.get(str(path[-2]))
+            container.extend([padding] * (key + 1 - len(container)))
+        container[key] = value
+    return res
+
+
+def get_leaves_key(leaves: list[ResolvedLeaf]) -> str:
+    """Identifies the content of resolved leaves, equal leaves render the same image."""
+    # images generated for the leaves (player heads) are only equal to themselves
+    data = [
+        (
+            model_def.model_dump(),
+            [tint.model_dump() for tint in tints],
+            transformation.model_dump() if transformation else None,
+        )
+        for model_def, tints, transformation in leaves
+    ]
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=repr).encode()).hexdigest()
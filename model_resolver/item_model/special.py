@@ -9,7 +9,7 @@ from model_resolver.item_model.tint_source import (
 from typing import ClassVar, Optional, Literal, Type, Any
 from model_resolver.item_model.item import Item
 from model_resolver.minecraft_model import MultiTexture, TextureSource
-from model_resolver.utils import clamp, resolve_key
+from model_resolver.utils import DiscriminatorIndex, clamp, resolve_key
 from model_resolver.pack_getter import PackGetter
 from PIL import Image
 from uuid import UUID
@@ -18,6 +18,9 @@ import base64
 
 
 SpecialModelBaseClass: list[Type["SpecialModelBase"]] = []
+SpecialModelBaseIndex: DiscriminatorIndex["SpecialModelBase"] = DiscriminatorIndex(
+    SpecialModelBaseClass, ("type",)
+)
 
 
 class SpecialModelBase(BaseModel):
@@ -1521,10 +1524,12 @@ class SpecialModel(RootModel[Any]):
 
     @cached_property
     def special_model(self) -> SpecialModelBase:
-        for cls in reversed(SpecialModelBaseClass):
+        errors: list[ValidationError] = []
+        for cls in SpecialModelBaseIndex.get_candidates(self.root):
             try:
                 return cls.model_validate(self.root)
             except ValidationError as e:
-                pass
-        print(list(reversed(SpecialModelBaseClass)))
+                errors.append(e)
+        if len(errors) > 0:
+            raise errors[0]
         raise ValueError("No valid special model found for root: " + str(self.root))
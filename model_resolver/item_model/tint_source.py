@@ -1,7 +1,6 @@
 from pydantic import BaseModel
 from typing import Literal, Optional, Union
 from model_resolver.utils import clamp
-from PIL import Image
 from model_resolver.item_model.item import Item
 from model_resolver.pack_getter import PackGetter
 
@@ -76,12 +75,9 @@ class TintSourceGrass(TintSourceBase):
 
     def resolve(self, getter: PackGetter, item: Item) -> tuple[int, int, int]:
         texture_key = "minecraft:colormap/grass"
-        if texture_key in getter.assets.textures:
-            texture = getter.assets.textures[texture_key]
-        else:
+        img = getter.get_image(texture_key)
+        if img is None:
             raise ValueError(f"{texture_key} not found in Context or Vanilla")
-        img: Image.Image = texture.image
-        img = img.convert(mode="RGB")
         temperature = clamp(0, self.temperature, 1)
         downfall = clamp(0, self.downfall, 1)
         adjusted_downfall = downfall * temperature
@@ -94,8 +90,8 @@ class TintSourceGrass(TintSourceBase):
         if not color:
             raise ValueError(f"Color not found at {temperature}, {downfall}")
         assert type(color) is tuple
-        assert len(color) == 3
-        return color
+        assert len(color) == 4
+        return color[:3]
 
 
 class TintSourceFirework(TintSourceBase):
@@ -1,11 +1,19 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 from pathlib import Path
-from typing import TYPE_CHECKING, Iterator, Mapping, Protocol, Optional, Sequence, Type, overload, cast
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Mapping, Protocol, Optional, Sequence, Type, overload, cast
+from zipfile import ZipFile
 
-from beet import LATEST_MINECRAFT_VERSION, Blockstate, Context, DataPack, Namespace, NamespaceContainer, NamespaceFile, NamespaceProxy, Pack, ResourcePack
+from beet import LATEST_MINECRAFT_VERSION, Blockstate, Context, DataPack, Model, Namespace, NamespaceContainer, NamespaceFile, NamespaceProxy, Pack, ResourcePack, TagFile
 from beet.contrib.vanilla import Vanilla, Release
+from beet.library.base import get_output_scope, list_input_scopes
 
-from model_resolver.utils import ModelResolverOptions
+from PIL import Image
+
+from model_resolver.utils import DecodedTextureCache, ModelResolverOptions, log
+
+if TYPE_CHECKING:
+    from model_resolver.item_model.model import ItemModel, ResolvedLeaf
 
 
 class PackGetterProtocol(Protocol):
@@ -22,6 +30,134 @@ class PackGetterLookup:
     data: Optional[DataPack] = None
 
 
+@dataclass
+class JarNamespaceProxy[T: NamespaceFile](Mapping[str, T]):
+    """Files of one type read from a jar, one member at a time."""
+    jar: Callable[[], ZipFile]
+    proxy_key: Type[T]
+    directory: str
+    files: dict[str, T] = field(default_factory=dict, repr=False)
+
+    @cached_property
+    def scopes(self) -> list[tuple[str, ...]]:
+        # older releases use the previous name of renamed directories
+        latest = get_output_scope(self.proxy_key.scope, None)
+        return [latest, *(scope for scope in list_input_scopes(self.proxy_key.scope) if scope != latest)]
+
+    def get_member(self, key: str) -> str:
+        namespace, _, path = key.partition(":")
+        jar = self.jar()
+        for scope in self.scopes:
+            member = "/".join((self.directory, namespace, *scope, path)) + self.proxy_key.extension
+            try:
+                jar.getinfo(member)
+            except KeyError:
+                continue
+            return member
+        raise KeyError(key)
+
+    def __getitem__(self, key: str) -> T:
+        try:
+            return self.files[key]
+        except KeyError:
+            pass
+        res = self.proxy_key.load(self.jar(), self.get_member(key))
+        self.files[key] = res
+        return res
+
+    @cached_property
+    def lookup_keys(self) -> list[str]:
+        res: dict[str, None] = {}
+        extension = self.proxy_key.extension
+        for member in self.jar().namelist():
+            if not member.endswith(extension):
+                continue
+            parts = member.split("/")
+            if parts[0] != self.directory:
+                continue
+            for scope in self.scopes:
+                depth = len(scope)
+                if len(parts) >= depth + 3 and tuple(parts[2:depth + 2]) == scope:
+                    path = "/".join(parts[depth + 2:]).removesuffix(extension)
+                    res[f"{parts[1]}:{path}"] = None
+                    break
+        return list(res)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.lookup_keys)
+
+    def __len__(self) -> int:
+        return len(self.lookup_keys)
+
+
+@dataclass
+class JarPack[T: Pack]:
+    """
+    A pack backed by the client jar of a release.
+    Namespace proxies read single members, only the rarely used namespace views mount the whole pack.
+    """
+    _pack: Type[T]
+    _lookup: VanillaLookup
+    _proxies: dict[Type[NamespaceFile], JarNamespaceProxy] = field(default_factory=dict, repr=False)
+
+    @cached_property
+    def _template(self) -> T:
+        return self._pack()
+
+    def __getitem__(self, key: type[NamespaceFile] | str):
+        if isinstance(key, str):
+            return get_pack(self._pack, self._lookup.release)[key]
+        if key not in self._proxies:
+            self._proxies[key] = JarNamespaceProxy(self._lookup.get_jar, key, self._pack.namespace_type.directory)
+        return self._proxies[key]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        proxy = getattr(self._template, name)
+        if not isinstance(proxy, NamespaceProxy):
+            return getattr(get_pack(self._pack, self._lookup.release), name)
+        return self[proxy.proxy_key]
+
+    def __iter__(self) -> Iterator[str]:
+        namespaces: dict[str, None] = {}
+        for member in self._lookup.get_jar().namelist():
+            directory, _, rest = member.partition("/")
+            if directory == self._pack.namespace_type.directory and "/" in rest:
+                namespaces[rest.partition("/")[0]] = None
+        return iter(namespaces)
+
+
+class VanillaLookup:
+    """
+    Vanilla resources read from the client jar of the release.
+    The release is only resolved, and its jar only opened, once a vanilla resource is requested.
+    """
+
+    def __init__(self, get_release: Callable[[], Release], version: str):
+        self.get_release = get_release
+        self.version = version
+
+    @cached_property
+    def release(self) -> Release:
+        return self.get_release()
+
+    @cached_property
+    def jar(self) -> ZipFile:
+        return ZipFile(self.release.client_jar.path)
+
+    def get_jar(self) -> ZipFile:
+        return self.jar
+
+    @cached_property
+    def assets(self) -> ResourcePack:
+        return cast(ResourcePack, JarPack(ResourcePack, self))
+
+    @cached_property
+    def data(self) -> DataPack:
+        return cast(DataPack, JarPack(DataPack, self))
+
+
 @overload
 def get_by_namespace_proxy[T: NamespaceFile](context: NamespaceProxy[T], vanilla: NamespaceProxy[T], key: str) -> T: ...
 @overload
@@ -73,6 +209,9 @@ def get_by_lookup_order[T: NamespaceFile](lookups: list[NamespaceProxy[T]] | lis
         raise KeyError(key)
     candidates.reverse()
     res = candidates[0]
+    if len(candidates) > 1:
+        # merge into a copy so the looked up packs are left untouched
+        res = res.copy()
     for cand in candidates[1:]:
         custom_merge(res, cand)
     return res
@@ -89,10 +228,11 @@ def iter_lookup_keys(lookups: Sequence[Mapping[str, object]]) -> Iterator[str]:
 
 
 def get_pack[T: Pack](pack: Type[T], thing: PackGetterProtocol) -> T:
+    # an empty pack is falsy, but it must stay the one the lookups point to
     if pack is ResourcePack:
-        return cast(T, thing.assets or ResourcePack())
+        return cast(T, thing.assets if thing.assets is not None else ResourcePack())
     if pack is DataPack:
-        return cast(T, thing.data or DataPack())
+        return cast(T, thing.data if thing.data is not None else DataPack())
     raise ValueError(f"Pack type {pack} is not valid")
 
 
@@ -104,31 +244,69 @@ class PackGetterNamespaceContainerProxy[T: NamespaceFile](Mapping[str, T]):
     def __getitem__(self, key: str):
         return get_by_lookup_order(self.lookups, key)
     
+    @cached_property
+    def lookup_keys(self) -> list[str]:
+        return list(iter_lookup_keys(self.lookups))
+
     def __iter__(self) -> Iterator[str]:
-        return iter_lookup_keys(self.lookups)
+        return iter(self.lookup_keys)
     
     def __len__(self) -> int:
-        return len({key for lookup in self.lookups for key in lookup})
+        return len(self.lookup_keys)
 
 
 @dataclass
 class PackGetterNamespaceProxy[T: NamespaceFile](Mapping[str, T]):
     lookups: list[NamespaceProxy[T]]
+    index: dict[str, T] = field(default_factory=dict)
+    missing: set[str] = field(default_factory=set)
+
+    def __getitem__(self, key: str) -> T:
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        if key in self.missing:
+            raise KeyError(key)
+        try:
+            res = get_by_lookup_order(self.lookups, key)
+        except KeyError:
+            self.missing.add(key)
+            raise
+        self.index[key] = res
+        return res
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.index:
+            return True
+        if not isinstance(key, str) or key in self.missing:
+            return False
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
 
-    def __getitem__(self, key: str):
-        return get_by_lookup_order(self.lookups, key)
+    @cached_property
+    def lookup_keys(self) -> list[str]:
+        return list(iter_lookup_keys(self.lookups))
     
     def __iter__(self) -> Iterator[str]:
-        return iter_lookup_keys(self.lookups)
+        return iter(self.lookup_keys)
 
     def __len__(self) -> int:
-        return len({key for lookup in self.lookups for key in lookup})
+        return len(self.lookup_keys)
 
 @dataclass
 class PackGetterNamespacePackProxy:
     lookups: list[Namespace]
+    _proxies: dict[str, PackGetterNamespaceContainerProxy] = field(default_factory=dict, repr=False)
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        if name in self._proxies:
+            return self._proxies[name]
         namespace_lookups = []
         for lookup in self.lookups:
             if not hasattr(lookup, name):
@@ -137,16 +315,32 @@ class PackGetterNamespacePackProxy:
             if not isinstance(lookup_proxy, NamespaceContainer):
                 raise TypeError(f"Attribute {name} of {lookup} is not a NamespaceContainer")
             namespace_lookups.append(lookup_proxy)
-        return PackGetterNamespaceContainerProxy(namespace_lookups)
+        proxy = PackGetterNamespaceContainerProxy(namespace_lookups)
+        self._proxies[name] = proxy
+        return proxy
 
 @dataclass
 class PackGetterPackProxy[T: Pack](Mapping[str, Namespace]):
-    """A merged view of packs, resolved in lookup order."""
+    """
+    A merged view of packs, resolved in lookup order.
+    The proxies it hands out are reused until the generation of the getter changes.
+    """
     _pack: Type[T]
     _getter: PackGetter
+    _proxies: dict[object, Any] = field(default_factory=dict, repr=False)
+    _generation: int = -1
+
+    def _cache(self) -> dict[object, Any]:
+        if self._generation != self._getter.generation:
+            self._proxies.clear()
+            self._generation = self._getter.generation
+        return self._proxies
 
     def _lookups(self) -> list[T]:
-        return [get_pack(self._pack, getattr(self._getter, lookup)) for lookup in self._getter.lookups]
+        cache = self._cache()
+        if "lookups" not in cache:
+            cache["lookups"] = [get_pack(self._pack, getattr(self._getter, lookup)) for lookup in self._getter.lookups]
+        return cache["lookups"]
 
     @overload
     def __getitem__(self, key: str): ...
@@ -155,50 +349,89 @@ class PackGetterPackProxy[T: Pack](Mapping[str, Namespace]):
     def __getitem__(self, key: type[NamespaceFile]): ...
 
     def __getitem__(self, key: type[NamespaceFile] | str): 
+        cache = self._cache()
+        if (proxy := cache.get(("item", key))) is not None:
+            return proxy
         lookups = self._lookups()
         if isinstance(key, type):
-            return PackGetterNamespaceProxy([lookup[key] for lookup in lookups])
+            proxy = PackGetterNamespaceProxy(
+                [lookup[key] for lookup in lookups],
+                self._getter.get_index(self._pack, key),
+                self._getter.get_missing(self._pack, key),
+            )
         elif isinstance(key, str):
-            return PackGetterNamespacePackProxy([lookup[key] for lookup in lookups])
+            proxy = PackGetterNamespacePackProxy([lookup[key] for lookup in lookups])
         else:
             raise ValueError(f"Key {key} is not recognised")
+        cache[("item", key)] = proxy
+        return proxy
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        cache = self._cache()
+        if (proxy := cache.get(("attr", name))) is not None:
+            return proxy
         namespace_lookups = []
         for lookup in self._lookups():
             if not hasattr(lookup, name):
                 raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
             lookup_proxy = getattr(lookup, name)
-            if not isinstance(lookup_proxy, NamespaceProxy):
+            if not isinstance(lookup_proxy, (NamespaceProxy, JarNamespaceProxy)):
                 raise TypeError(f"Attribute {name} of {lookup} is not a NamespaceProxy")
             namespace_lookups.append(lookup_proxy)
-        return PackGetterNamespaceProxy(namespace_lookups)
+        file_type = namespace_lookups[0].proxy_key
+        proxy = PackGetterNamespaceProxy(
+            namespace_lookups,
+            self._getter.get_index(self._pack, file_type),
+            self._getter.get_missing(self._pack, file_type),
+        )
+        cache[("attr", name)] = proxy
+        return proxy
+
+    def _keys(self) -> list[str]:
+        cache = self._cache()
+        if "keys" not in cache:
+            cache["keys"] = list(iter_lookup_keys(self._lookups()))
+        return cache["keys"]
     
     def __iter__(self):
-        seen: set[str] = set()
-        for lookup in self._lookups():
-            for key in lookup:
-                if key in seen:
-                    continue
-                seen.add(key)
-                yield key
+        return iter(self._keys())
 
     def __len__(self) -> int:
-        return len({key for lookup in self._lookups() for key in lookup})
+        return len(self._keys())
 
 @dataclass
 class PackGetterPackProxyDescriptor[T: Pack]:
     _pack: Type[T]
     def __get__(self, instance, owner) -> PackGetterPackProxy[T]:
-        return PackGetterPackProxy(self._pack, instance) 
+        if instance is None:
+            return self # type: ignore
+        proxy = instance._pack_proxies.get(self._pack)
+        if proxy is None:
+            proxy = PackGetterPackProxy(self._pack, instance)
+            instance._pack_proxies[self._pack] = proxy
+        return proxy
 
 
 class PackGetter():
     _ctx: Context
-    _vanilla: Release
+    _vanilla_lookup: VanillaLookup
     _static_lookup: PackGetterLookup
     opts: ModelResolverOptions
     lookups: list[str]
+    _index: dict[tuple[Type[Pack], Type[NamespaceFile]], dict[str, NamespaceFile]]
+    _missing: dict[tuple[Type[Pack], Type[NamespaceFile]], set[str]]
+    _pack_proxies: dict[Type[Pack], PackGetterPackProxy]
+    missing_references: dict[str, set[str]]
+    decoded_textures: DecodedTextureCache
+    # item models parsed once per file, see ItemModel.from_key
+    parsed_item_models: dict[str, tuple[NamespaceFile, "ItemModel"]]
+    # leaves of the item models by read components and their values, see resolve_item_model
+    resolved_item_models: dict[str, dict[tuple[tuple[str, str], ...], dict[str, list["ResolvedLeaf"]]]]
+    # data pack tags flattened once, by tags attribute and tag, see get_tagged_ids
+    tag_index: dict[tuple[str, str], frozenset[str]]
+    generation: int
 
     if TYPE_CHECKING and False:
         assets: ResourcePack
@@ -209,27 +442,107 @@ class PackGetter():
 
     def __init__(self, 
         ctx: Context, 
-        vanilla: Release, 
+        vanilla: Release | VanillaLookup, 
         static_lookup: PackGetterLookup, 
         opts: ModelResolverOptions, 
         lookups: list[str]
     ) -> None:
         self.lookups = lookups
         self._ctx = ctx
-        self._vanilla = vanilla
+        if isinstance(vanilla, Release):
+            release = vanilla
+            vanilla = VanillaLookup(lambda: release, release.info.data["id"])
+        self._vanilla_lookup = vanilla
         self._static_lookup = static_lookup
         self.opts = opts
+        self._index = {}
+        self._missing = {}
+        self._pack_proxies = {}
+        self.missing_references = {}
+        self.decoded_textures = DecodedTextureCache(opts.texture_cache_size)
+        self.parsed_item_models = {}
+        self.resolved_item_models = {}
+        self.tag_index = {}
+        self.generation = 0
+
+    @property
+    def _vanilla(self) -> Release:
+        return self._vanilla_lookup.release
+
+    @property
+    def minecraft_version(self) -> str:
+        return self._vanilla_lookup.version
+
+    def get_index[T: NamespaceFile](self, pack: Type[Pack], file_type: Type[T]) -> dict[str, T]:
+        """The merged files already resolved for a file type, keyed by resource location."""
+        return cast(dict[str, T], self._index.setdefault((pack, file_type), {}))
+
+    def get_missing(self, pack: Type[Pack], file_type: Type[NamespaceFile]) -> set[str]:
+        """The keys already known to be absent from every lookup."""
+        return self._missing.setdefault((pack, file_type), set())
+
+    def invalidate(self, file_type: Type[NamespaceFile] | None = None, key: str | None = None):
+        """
+        Drop merged files from the index.
+        Must be called after writing in one of the looked up packs.
+        """
+        self.generation += 1
+        if file_type is None or file_type is Model:
+            # resolved item models bake their models
+            self.resolved_item_models.clear()
+        if file_type is None or issubclass(file_type, TagFile):
+            self.tag_index.clear()
+        if file_type is None:
+            self._index.clear()
+            self._missing.clear()
+            return
+        for (_, indexed_type), index in self._index.items():
+            if indexed_type is not file_type:
+                continue
+            if key is None:
+                index.clear()
+            else:
+                index.pop(key, None)
+        for (_, indexed_type), missing in self._missing.items():
+            if indexed_type is not file_type:
+                continue
+            if key is None:
+                missing.clear()
+            else:
+                missing.discard(key)
+
+    def get_image(self, key: str) -> Optional[Image.Image]:
+        """The decoded RGBA image of a texture, shared by every task."""
+        texture = self.assets.textures.get(key)
+        if texture is None:
+            return None
+        return self.decoded_textures.get(("texture", key), texture, lambda: texture.image)
+
+    def report_missing(self, reference: str, source: Optional[str] = None):
+        """Record a reference that couldn't be resolved, summarized by `log_missing_references`."""
+        self.missing_references.setdefault(reference, set()).add(source or "unknown")
+
+    def log_missing_references(self):
+        if not self.missing_references:
+            return
+        lines = [f"{len(self.missing_references)} missing references:"]
+        for reference, sources in sorted(self.missing_references.items()):
+            lines.append(f"  {reference} (from {', '.join(sorted(sources))})")
+        log.warning("\n".join(lines))
+        self.missing_references.clear()
 
 
     @classmethod
     def from_context(cls, ctx: Context, version: str | None = None):
         opts = ctx.validate("model_resolver", ModelResolverOptions)
-        vanilla = Vanilla(ctx)
         minecraft_version = version or opts.minecraft_version or ctx.minecraft_version
         if minecraft_version == "latest":
             minecraft_version = LATEST_MINECRAFT_VERSION
-        release = vanilla.releases[minecraft_version]
+
+        def get_release() -> Release:
+            return Vanilla(ctx).releases[minecraft_version]
+
         static_models = Path(__file__).parent / "static_models"
         static_lookup = PackGetterLookup(assets=ResourcePack(path=static_models))        
-        return cls(ctx, release, static_lookup, opts, ["_ctx", "_static_lookup", "_vanilla", ])
+        return cls(ctx, VanillaLookup(get_release, minecraft_version), static_lookup, opts, ["_ctx", "_static_lookup", "_vanilla_lookup", ])
         
\ No newline at end of file
@@ -34,7 +34,7 @@ def render_all_vanilla_webp(ctx: Context):
 
 def render_all_vanilla_option(ctx: Context, animated_as_webp: bool = True):
     render = Render(ctx)
-    for model in render.getter._vanilla.assets.models:
+    for model in render.getter._vanilla_lookup.assets.models:
         namespace, path = model.split(":")
         render.add_model_task(
             model,
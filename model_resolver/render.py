@@ -7,22 +7,27 @@ from model_resolver.my_glut_init import glutInit
 from beet import Context, Atlas
 from dataclasses import dataclass, field
 from model_resolver.item_model.item import Item
-from model_resolver.tasks.item import ItemRenderTask
+from model_resolver.tasks.item import ItemRenderTask, ItemVariantsRenderTask
 from model_resolver.tasks.model import ModelPathRenderTask, ModelRenderTask
-from model_resolver.tasks.structure import StructureRenderTask
+from model_resolver.tasks.structure import LevelOfDetail, StructureRenderTask
 from model_resolver.utils import (
     LightOptions,
     ModelResolverOptions,
+    PackedTextureCache,
     resolve_key,
     DEFAULT_RENDER_SIZE,
     log,
 )
 from model_resolver.pack_getter import PackGetter
-from typing import Any, Literal, Optional, TypedDict
+from functools import partial
+import hashlib
+import json
+from typing import Any, Callable, Literal, Optional, TypedDict
 from pathlib import Path
 from PIL import Image
+import numpy as np
 
-from model_resolver.tasks.base import AnimationType, Task, RenderError
+from model_resolver.tasks.base import AnimationType, Task, RenderError, share_renders
 
 
 class AtlasDict(TypedDict):
@@ -34,6 +39,39 @@ class AtlasDict(TypedDict):
     sprite: str
 
 
+class DynamicTextures(dict[str, Image.Image]):
+    """
+    Sprites created by the atlases, generated the first time they are requested.
+    When a cache is set, generated sprites are also packed into it for the next runs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sources: dict[str, Callable[[], Image.Image]] = {}
+        self.cache: Optional[PackedTextureCache] = None
+
+    def add_source(self, key: str, source: Callable[[], Image.Image]):
+        self.sources[key] = source
+        self.pop(key, None)
+
+    def __missing__(self, key: str) -> Image.Image:
+        if key not in self.sources:
+            raise KeyError(key)
+        img = self.cache.get(key) if self.cache else None
+        if img is None:
+            img = self.sources[key]()
+            if self.cache:
+                self.cache.put(key, img)
+        self[key] = img
+        return img
+
+    def __contains__(self, key: object) -> bool:
+        return super().__contains__(key) or key in self.sources
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+
 class AppendList[T: Any](list[T]):
     def append[U: T](self, object: U) -> U:
         super().append(object)
@@ -47,13 +85,16 @@ class Render:
     tasks: AppendList[Task] = field(default_factory=AppendList)
     tasks_index: int = 0
     light: LightOptions = field(default_factory=LightOptions)
-    dynamic_textures: dict[str, Image.Image] = field(default_factory=dict)
+    dynamic_textures: DynamicTextures = field(default_factory=DynamicTextures)
+    uploaded_textures: dict[str, tuple[Image.Image, int]] = field(default_factory=dict)
     default_render_size: int = DEFAULT_RENDER_SIZE
     default_animated_path_padding: int = 3
     random_seed: int = 143221
 
     def __post_init__(self):
         self.getter = PackGetter.from_context(self.ctx)
+        if not isinstance(self.dynamic_textures, DynamicTextures):
+            self.dynamic_textures = DynamicTextures(self.dynamic_textures)
 
     def __repr__(self):
         return f"<Render of {len(self.tasks)} tasks>"
@@ -92,6 +133,40 @@ class Render:
             )
         )
 
+    def add_item_variants_task(
+        self,
+        item: Item,
+        *,
+        path_ctx: Optional[str] = None,
+        path_save: Optional[Path] = None,
+        render_size: Optional[int] = None,
+        animation_mode: AnimationType = "multi_files",
+        animation_framerate: int = 20,
+        animated_path_padding: Optional[int] = None,
+    ):
+        """
+        Render every variant of the item model of an item, each distinct one once.
+        `path_ctx` or `path_save` is a directory receiving the renders and a manifest.json.
+        """
+        if render_size is None:
+            render_size = self.default_render_size
+        if isinstance(path_save, str):
+            path_save = Path(path_save)
+        if animated_path_padding is None:
+            animated_path_padding = self.default_animated_path_padding
+        return self.tasks.append(
+            ItemVariantsRenderTask(
+                getter=self.getter,
+                item=item.fill(self.ctx),
+                path_ctx=path_ctx,
+                path_save=path_save,
+                render_size=render_size,
+                animation_mode=animation_mode,
+                animation_framerate=animation_framerate,
+                animated_path_padding=animated_path_padding,
+            )
+        )
+
     def add_model_task(
         self,
         model: str,
@@ -165,6 +240,7 @@ class Render:
         animation_framerate: int = 20,
         display_option: Optional[DisplayOptionModel | dict[str, Any]] = None,
         animated_path_padding: Optional[int] = None,
+        level_of_detail: LevelOfDetail = "auto",
     ):
         kwargs: dict[Literal["display_option"], DisplayOptionModel] = {}
         if render_size is None:
@@ -188,72 +264,73 @@ class Render:
                 animation_mode=animation_mode,
                 animation_framerate=animation_framerate,
                 animated_path_padding=animated_path_padding,
+                level_of_detail=level_of_detail,
                 **kwargs,
             )
         )
 
     def resolve_dynamic_textures(self):
+        """Register the sprites of every atlas, they are only generated when a task needs them."""
         log.info(f"Resolving dynamic textures")
-        # first, resolve all vanilla altas
         cache = self.ctx.cache.get("model_resolver_dynamic_textures")
         assert cache
         opts = self.ctx.validate("model_resolver", ModelResolverOptions)
-        if "dynamic_textures" in cache.json and opts.use_cache:
-            log.info("Using cached dynamic textures")
-            for key, path in cache.json["dynamic_textures"].items():
-                self.dynamic_textures[key] = Image.open(path)
-            return
-        # clear the dynamic textures
-        if opts.use_cache:
-            cache.clear()
-        # construct the dynamic textures
-        atlases = {
-            **{key: value for key, value in self.getter.assets.atlases.items()},
-        }
+        atlases = dict(self.getter.assets.atlases.items())
         for key, atlas in atlases.items():
             log.info(f"Creating atlas {key}")
             self.resolve_altas(key, atlas)
-        if not opts.use_cache:
-            return
-        log.info("Caching dynamic textures")
-        # construct the cache
-        cache.json["dynamic_textures"] = {}
-        for key, value in self.dynamic_textures.items():
-            path = cache.get_path(f"{key}.png")
-            with open(path, "wb") as f:
-                value.save(f, "PNG")
-            cache.json["dynamic_textures"][key] = str(path)
-
+        if opts.use_cache:
+            # previous versions stored one png per sprite
+            cache.json.pop("dynamic_textures", None)
+            fingerprint = self.get_atlases_fingerprint(atlases)
+            self.dynamic_textures.cache = PackedTextureCache(cache, fingerprint)
+
+    def get_atlases_fingerprint(self, atlases: dict[str, Atlas]) -> str:
+        """Hash of everything the generated sprites depend on besides their grayscale textures."""
+        fingerprint = hashlib.sha256(self.getter.minecraft_version.encode())
+        palettes: set[str] = set()
+        for key, atlas in sorted(atlases.items()):
+            fingerprint.update(key.encode())
+            fingerprint.update(json.dumps(atlas.data, sort_keys=True).encode())
+            for source in atlas.data.get("sources", []):
+                if resolve_key(source["type"]) == "minecraft:paletted_permutations":
+                    palettes.add(resolve_key(source["palette_key"]))
+                    palettes.update(resolve_key(path) for path in source["permutations"].values())
+        for palette_key in sorted(palettes):
+            palette = self.getter.get_image(palette_key)
+            fingerprint.update(palette_key.encode())
+            if palette is not None:
+                fingerprint.update(f"{palette.size}".encode())
+                fingerprint.update(palette.tobytes())
+        return fingerprint.hexdigest()
+
+    @staticmethod
     def apply_palette(
-        self, texture: Image.Image, palette: Image.Image, color_palette: Image.Image
+        texture: Image.Image, palette: Image.Image, color_palette: Image.Image
     ) -> Image.Image:
-        new_image = Image.new("RGBA", texture.size)
-        texture = texture.convert("RGBA")
-        palette = palette.convert("RGB")
-        color_palette = color_palette.convert("RGB")
-        for x in range(texture.width):
-            for y in range(texture.height):
-                pixel = texture.getpixel((x, y))
-                if not isinstance(pixel, tuple):
-                    raise ValueError("Texture is not RGBA")
-                color = pixel[:3]
-                alpha = pixel[3]
-                # if the color is in palette_key, replace it with the color from color_palette
-                found = False
-                for i in range(palette.width):
-                    for j in range(palette.height):
-                        if palette.getpixel((i, j)) == color:
-                            new_color = color_palette.getpixel((i, j))
-                            if not isinstance(new_color, tuple):
-                                raise ValueError("Color palette is not RGB")
-                            new_image.putpixel((x, y), new_color + (alpha,))
-                            found = True
-                            break
-                    if found:
-                        break
-                if not found:
-                    new_image.putpixel((x, y), pixel)
-        return new_image
+        """
+        Replace every texture pixel whose color is in `palette` by the color at the same position
+        in `color_palette`, keeping its alpha. The first match in column order wins.
+        """
+        pixels = np.array(texture.convert("RGBA"), dtype=np.uint8)
+        # palette positions in the order they used to be scanned: x first, then y
+        palette_colors = np.asarray(palette.convert("RGB"), dtype=np.uint32).transpose(1, 0, 2).reshape(-1, 3)
+        if len(palette_colors) == 0:
+            return Image.fromarray(pixels)
+        new_colors = np.asarray(color_palette.convert("RGB"), dtype=np.uint8)
+
+        def pack(colors: np.ndarray) -> np.ndarray:
+            colors = colors.astype(np.uint32)
+            return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+        # np.unique keeps the first index of duplicated palette colors
+        lut_keys, first_index = np.unique(pack(palette_colors), return_index=True)
+        keys = pack(pixels[..., :3])
+        position = np.minimum(np.searchsorted(lut_keys, keys), len(lut_keys) - 1)
+        found = lut_keys[position] == keys
+        palette_x, palette_y = np.divmod(first_index[position[found]], palette.height)
+        pixels[found, :3] = new_colors[palette_y, palette_x]
+        return Image.fromarray(pixels)
 
     def resolve_altas(self, key: str, atlas: Atlas):
         for source in atlas.data["sources"]:
@@ -265,46 +342,51 @@ class Render:
                 resource = resolve_key(source["resource"])
                 sprite = resolve_key(source.get("sprite", source["resource"]))
                 if resource in self.getter.assets.textures:
-                    self.dynamic_textures[sprite] = self.getter.assets.textures[resource].image
+                    self.dynamic_textures.add_source(
+                        sprite, partial(self.resolve_single_texture, resource)
+                    )
                 continue
             elif source_type == "minecraft:paletted_permutations":
                 for texture in source["textures"]:
                     for variant, color_palette_path in source["permutations"].items():
-                        self.resolve_altas_texture(
-                            texture, variant, source, color_palette_path
+                        new_texture_path = resolve_key(f"{texture}_{variant}")
+                        self.dynamic_textures.add_source(
+                            new_texture_path,
+                            partial(
+                                self.resolve_altas_texture,
+                                texture,
+                                variant,
+                                source,
+                                color_palette_path,
+                            ),
                         )
 
+    def resolve_single_texture(self, resource: str) -> Image.Image:
+        return self.getter.assets.textures[resource].image
+
     def resolve_altas_texture(
         self, texture: str, variant: str, source: AtlasDict, color_palette_path: str
-    ):
-        new_texture_path = f"{texture}_{variant}"
-        new_texture_path = resolve_key(new_texture_path)
-
+    ) -> Image.Image:
         palette_key = resolve_key(source["palette_key"])
-        if palette_key in self.getter.assets.textures:
-            palette = self.getter.assets.textures[palette_key].image
-        else:
+        palette = self.getter.get_image(palette_key)
+        if palette is None:
             raise RenderError(f"Palette {palette_key} not found")
 
         color_palette_key = resolve_key(color_palette_path)
-        if color_palette_key in self.getter.assets.textures:
-            color_palette: Image.Image = self.getter.assets.textures[
-                color_palette_key
-            ].image
-        else:
+        color_palette = self.getter.get_image(color_palette_key)
+        if color_palette is None:
             raise RenderError(f"Color palette {color_palette_key} not found")
 
         grayscale_key = resolve_key(texture)
-        if grayscale_key in self.getter.assets.textures:
-            grayscale = self.getter.assets.textures[grayscale_key].image
-        else:
+        grayscale = self.getter.get_image(grayscale_key)
+        if grayscale is None:
             raise RenderError(f"Grayscale {grayscale_key} not found")
 
-        img = self.apply_palette(grayscale, palette, color_palette)
-
-        self.dynamic_textures[new_texture_path] = img
+        return self.apply_palette(grayscale, palette, color_palette)
 
     def run(self):
+        # the context may have changed since the getter was created
+        self.getter.invalidate()
         self.resolve_dynamic_textures()
         glutInit()
         glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA | GLUT_DEPTH)  # type: ignore
@@ -327,12 +409,19 @@ class Render:
         for task in self.tasks:
             new_tasks.extend(task.resolve())
         self.tasks = new_tasks
+        if saved := share_renders(self.tasks):
+            log.info(f"{saved} of {len(self.tasks)} renders saved by sharing identical ones")
 
         glutDisplayFunc(self.display)
         glutIdleFunc(self.display)
         glutReshapeFunc(self.reshape)
 
-        glutMainLoop()
+        try:
+            glutMainLoop()
+        finally:
+            self.getter.log_missing_references()
+            if self.dynamic_textures.cache:
+                self.dynamic_textures.cache.close()
 
     def reshape(self, width: int, height: int):
         glViewport(0, 0, width, height)
@@ -358,6 +447,15 @@ class Render:
             return
 
     def real_display(self):
+        if (source := self.current_task.shared_render) is not None:
+            # same frame as an earlier task, reuse its render
+            assert source.rendered_img is not None
+            self.current_task.save(source.rendered_img)
+            source.pending_shares -= 1
+            if source.pending_shares == 0:
+                source.rendered_img = None
+            return 1
+
         if not self.current_task.ensure_params:
             self.current_task.ensure_params = True
             self.current_task.change_params()
@@ -418,6 +516,7 @@ class Render:
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)  # type: ignore
 
         self.current_task.dynamic_textures = self.dynamic_textures
+        self.current_task.uploaded_textures = self.uploaded_textures
         self.current_task.run()
 
         pixel_data = glReadPixels(
@@ -434,6 +533,8 @@ class Render:
             pixel_data,  # type: ignore
         )
         img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+        if self.current_task.pending_shares > 0:
+            self.current_task.rendered_img = img
 
         # Save the image
         self.current_task.save(img)
@@ -9,7 +9,7 @@ from model_resolver.utils import (
     DEFAULT_RENDER_SIZE,
 )
 from model_resolver.pack_getter import PackGetter
-from typing import Literal, Optional, Generator
+from typing import Hashable, Literal, Optional, Generator
 from pathlib import Path
 from PIL import Image
 
@@ -41,6 +41,11 @@ class Task:
 
     tasks: list["Task"] = field(default_factory=list)
 
+    # Set on an animation frame identical to a previous one, whose render is saved again
+    shared_render: Optional["Task"] = None
+    pending_shares: int = 0
+    rendered_img: Optional[Image.Image] = None
+
     @property
     def duration_coef(self):
         if self.animation_framerate % 20 != 0 and self.animation_framerate > 0:
@@ -49,6 +54,8 @@ class Task:
 
     ensure_params: bool = False
     dynamic_textures: dict[str, Image.Image] = field(default_factory=dict)
+    # GL textures uploaded during the render session, by texture path, with the image they hold
+    uploaded_textures: dict[str, tuple[Image.Image, int]] = field(default_factory=dict)
 
     def change_params(self):
         glMatrixMode(GL_PROJECTION)
@@ -68,6 +75,13 @@ class Task:
         self.animation_mode = "multi_files"
         yield self
 
+    def get_render_key(self) -> Optional[Hashable]:
+        """
+        Identifies the image rendered by the task once resolved: tasks with the same key
+        render the same image. None when the task can't tell.
+        """
+        return None
+
     def run(self):
         pass
 
@@ -84,11 +98,51 @@ class Task:
         ):
             self.saved_img = img
             return
+        elif self.animation_mode == "webp":
+            # kept for the AnimatedResultTask
+            self.saved_img = img
+            return
         elif self.path_ctx and self.animation_mode in ["one_file", "multi_files"]:
             data = io.BytesIO()
             img.save(data, format="png")
             self.getter._ctx.assets.textures[self.path_ctx] = Texture(data.getvalue())
+            self.getter.invalidate(Texture, self.path_ctx)
         elif self.path_save and self.animation_mode in ["one_file", "multi_files"]:
             os.makedirs(self.path_save.parent, exist_ok=True)
             img.save(self.path_save)
         self.flush()
+
+
+def share_render(task: Task, key: Hashable, renders: dict[Hashable, Task]) -> Task:
+    """Make `task` reuse the render of the first task with the same key."""
+    if key in renders:
+        source = renders[key]
+        source.pending_shares += 1
+        task.shared_render = source
+    else:
+        renders[key] = task
+    return task
+
+
+def share_renders(tasks: list[Task]) -> int:
+    """
+    Make the resolved tasks rendering the same image as an earlier one reuse its render.
+    Returns the number of renders saved.
+    """
+    renders: dict[Hashable, Task] = {}
+    saved = 0
+    for task in tasks:
+        if (source := task.shared_render) is not None:
+            # the source of an animation frame may now reuse the render of another task
+            if source.shared_render is not None:
+                task.shared_render = source.shared_render
+            continue
+        key = task.get_render_key()
+        if key is None:
+            continue
+        share_render(task, key, renders)
+        if (source := task.shared_render) is not None:
+            source.pending_shares += task.pending_shares
+            task.pending_shares = 0
+            saved += 1
+    return saved
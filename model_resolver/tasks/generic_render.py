@@ -1,3 +1,5 @@
+import hashlib
+import json
 from pathlib import Path
 from OpenGL.GL import *  # pyright: ignore[reportWildcardImportFromLibrary]
 from OpenGL.GLUT import *  # pyright: ignore[reportWildcardImportFromLibrary]
@@ -27,10 +29,25 @@ from model_resolver.minecraft_model import (
     TextureSource,
 )
 from model_resolver.item_model.tint_source import TintSource
-from typing import Any, Optional, Generator, Literal
+from model_resolver.item_model.model import ResolvedLeaf, get_leaves_key
+from typing import Any, Iterator, Optional, Generator, Literal
 from PIL import Image
 from model_resolver.tasks.base import Task, RenderError
-from math import pi, cos, sin, sqrt
+from math import lcm, pi, cos, sin, sqrt
+from functools import partial
+
+
+MISSINGNO_PATH = Path(__file__).parent.parent / "missingno.png"
+
+# Indices in the vertices returned by get_vertices for each face, in drawing order
+FACE_VERTICES_ORDER: dict[str, tuple[int, int, int, int]] = {
+    "down": (7, 6, 1, 0),
+    "up": (3, 2, 5, 4),
+    "south": (4, 5, 6, 7),
+    "north": (2, 3, 0, 1),
+    "east": (5, 2, 1, 6),
+    "west": (3, 4, 7, 0),
+}
 
 
 type TextureBindingsValue = tuple[tuple[tuple[int, TintSource | None], ...], str]
@@ -81,10 +98,38 @@ class GenericModelRenderTask(Task):
     offset: tuple[float, float, float] = (0, 0, 0)
     center_offset: tuple[float, float, float] = (0, 0, 0)
     additional_rotations: list[RotationModel] = field(default_factory=list)
+    # Frame shown for animated textures, by texture path: (frame index, frame count)
+    animation_frames: dict[str, tuple[int, float]] = field(default_factory=dict)
+    # GL textures uploaded for a single draw, deleted by release_textures
+    transient_textures: list[int] = field(default_factory=list)
 
     def flush(self):
         super().flush()
         self.item = Item(id="do_not_use")
+        self.uploaded_textures = {}
+
+    def get_leaves_render_key(self, leaves: list[ResolvedLeaf]) -> str:
+        """Identifies the image of the leaves rendered with the parameters of the task."""
+        tints: list[TintSource] = []
+        for model_def, model_tints, _ in leaves:
+            tints.extend(model_tints)
+            for value in model_def.textures.values():
+                if isinstance(value, tuple):
+                    tints.extend(tint for _, tint in value if tint is not None)
+        data = [
+            get_leaves_key(leaves),
+            # tints are resolved with the item when drawing
+            [tint.resolve(self.getter, item=self.item) for tint in tints],
+            self.render_size,
+            self.zoom,
+            self.do_rotate_camera,
+            self.offset,
+            self.center_offset,
+            [rotation.model_dump() for rotation in self.additional_rotations],
+            sorted(self.animation_frames.items()),
+            sorted((key, id(img)) for key, img in self.dynamic_textures.items()),
+        ]
+        return hashlib.sha256(json.dumps(data, default=repr).encode()).hexdigest()
 
     def get_textures(self, model: MinecraftModel, images: dict[str, Image.Image]):
         textures = {}
@@ -92,10 +137,9 @@ class GenericModelRenderTask(Task):
             if isinstance(value, Image.Image):
                 raise RenderError(f"WTF is going on")
             elif isinstance(value, tuple):
-                for texture, tint in value:
-                    ...
+                textures[key] = value
             elif isinstance(value, TextureDict):
-                textures[key] = images[value.sprite]
+                textures[key] = images.get(value.sprite, value)
             elif resolve_key(value) in [resolve_key(k) for k in images.keys()]:
                 textures[key] = images[value]
             else:
@@ -148,10 +192,19 @@ class GenericModelRenderTask(Task):
         """Returns a missingno image for debugging purposes."""
         if self.getter.opts.transparent_missingno:
             return Image.new("RGBA", (16, 16), (0, 0, 0, 0))
-        path = Path(__file__).parent.parent / "missingno.png"
-        if not path.exists():
-            raise RenderError(f"Missingno image not found at {path}")
-        return Image.open(path).convert("RGBA")
+        if not MISSINGNO_PATH.exists():
+            raise RenderError(f"Missingno image not found at {MISSINGNO_PATH}")
+        return self.getter.decoded_textures.get(
+            ("missingno", ""), MISSINGNO_PATH, lambda: Image.open(MISSINGNO_PATH)
+        )
+
+    def get_texture_image(self, path: str) -> Optional[Image.Image]:
+        """The decoded RGBA image of a texture, looked up in the packs then in the dynamic textures."""
+        img = self.getter.get_image(path)
+        if img is None and path in self.dynamic_textures:
+            dynamic = self.dynamic_textures[path]
+            img = self.getter.decoded_textures.get(("dynamic", path), dynamic, lambda: dynamic)
+        return img
 
     def load_textures(
         self, model: MinecraftModel, source: Optional[str] = None
@@ -167,7 +220,7 @@ class GenericModelRenderTask(Task):
                 continue
             if value is None:
                 res[key] = (self.get_missingno(), "empty")
-                log.warning(f"Texture {key} not found in {source}")
+                self.getter.report_missing(f"#{key}", source)
             elif isinstance(value, Image.Image):
                 res[key] = (value, "dynamic")
             elif isinstance(value, tuple):
@@ -175,34 +228,75 @@ class GenericModelRenderTask(Task):
                 textures: list[MultiTextureResolved] = []
                 for texture, tint in value:
                     path = resolve_key(texture)
-                    if path in self.getter.assets.textures:
-                        texture = self.getter.assets.textures[path]
-                        img: Image.Image = texture.image
-                    elif path in self.dynamic_textures:
-                        texture = Texture(self.dynamic_textures[path])
-                        img = texture.image
-                    else:
+                    img = self.get_texture_image(path)
+                    if img is None:
                         img = self.get_missingno()
-                        log.warning(f"Texture {key} not found at {path}")
-
-                    img = img.convert("RGBA")
+                        self.getter.report_missing(path, source)
                     textures.append((img, tint))
                 res[key] = (tuple(textures), key)
             else:
                 path = resolve_key(value)
-                if path in self.getter.assets.textures:
-                    texture = self.getter.assets.textures[path]
-                    img: Image.Image = texture.image
-                elif path in self.dynamic_textures:
-                    texture = Texture(self.dynamic_textures[path])
-                    img = texture.image
-                else:
+                img = self.get_texture_image(path)
+                if img is None:
                     img = self.get_missingno()
-                    log.warning(f"Texture {key} not found at {path}")
-                img = img.convert("RGBA")
+                    self.getter.report_missing(path, source)
                 res[key] = (img, path)
         return res
 
+    def upload_texture(self, img: Image.Image) -> int:
+        tex_id: int = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, tex_id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        img = img.convert("RGBA")
+        img_data = img.tobytes("raw", "RGBA")
+        glTexImage2D(
+            GL_TEXTURE_2D,
+            0,
+            GL_RGBA,
+            img.width,
+            img.height,
+            0,
+            GL_RGBA,
+            GL_UNSIGNED_BYTE,
+            img_data,
+        )
+        return tex_id
+
+    def get_texture_id(self, img: Image.Image, path: str) -> int:
+        """Textures of the packs are uploaded once per render session, as long as their image is the same."""
+        if path in ("dynamic", "empty"):
+            tex_id = self.upload_texture(img)
+            self.transient_textures.append(tex_id)
+            return tex_id
+        uploaded = self.uploaded_textures.get(path)
+        if uploaded is not None and uploaded[0] is img:
+            return uploaded[1]
+        if uploaded is not None:
+            # the texture changed, the previous one can still be bound until released
+            self.transient_textures.append(uploaded[1])
+        tex_id = self.upload_texture(img)
+        self.uploaded_textures[path] = (img, tex_id)
+        return tex_id
+
+    def get_frame_texture_id(self, path: str, index: int) -> int:
+        """A single frame of an animated texture, for faces sampling outside of the frame."""
+        img = self.uploaded_textures[path][0]
+        frame_path = f"{path}#frame_{index}"
+        uploaded = self.uploaded_textures.get(frame_path)
+        if uploaded is not None and uploaded[0] is img:
+            return uploaded[1]
+        if uploaded is not None:
+            self.transient_textures.append(uploaded[1])
+        tex_id = self.upload_texture(Animation.crop_frame(img, index))
+        self.uploaded_textures[frame_path] = (img, tex_id)
+        return tex_id
+
+    def release_textures(self):
+        if len(self.transient_textures) > 0:
+            glDeleteTextures(self.transient_textures)
+        self.transient_textures = []
+
     def generate_textures_bindings(
         self, model: MinecraftModel, source: Optional[str] = None
     ):
@@ -210,44 +304,12 @@ class GenericModelRenderTask(Task):
         textures = self.load_textures(model, source)
         for key, (value, path) in textures.items():
             if isinstance(value, Image.Image):
-                tex_id: int = glGenTextures(1)
-                glBindTexture(GL_TEXTURE_2D, tex_id)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-                value = value.convert("RGBA")
-                img_data = value.tobytes("raw", "RGBA")
-                glTexImage2D(
-                    GL_TEXTURE_2D,
-                    0,
-                    GL_RGBA,
-                    value.width,
-                    value.height,
-                    0,
-                    GL_RGBA,
-                    GL_UNSIGNED_BYTE,
-                    img_data,
-                )
-                res[key] = (((tex_id, None),), path)
+                res[key] = (((self.get_texture_id(value, path), None),), path)
             elif isinstance(value, tuple):
                 res_value: list[tuple[int, TintSource | None]] = []
                 for img, tint in value:
-                    tex_id: int = glGenTextures(1)
-                    glBindTexture(GL_TEXTURE_2D, tex_id)
-                    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-                    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-                    img = img.convert("RGBA")
-                    img_data = img.tobytes("raw", "RGBA")
-                    glTexImage2D(
-                        GL_TEXTURE_2D,
-                        0,
-                        GL_RGBA,
-                        img.width,
-                        img.height,
-                        0,
-                        GL_RGBA,
-                        GL_UNSIGNED_BYTE,
-                        img_data,
-                    )
+                    tex_id = self.upload_texture(img)
+                    self.transient_textures.append(tex_id)
                     res_value.append((tex_id, tint))
                 res[key] = (tuple(res_value), path)
             else:
@@ -263,6 +325,15 @@ class GenericModelRenderTask(Task):
     ):
         self.rotate_camera(model, transformation)
         textures_bindings = self.generate_textures_bindings(model, source)
+        self.draw_model(model, textures_bindings, tints)
+        self.release_textures()
+
+    def draw_model(
+        self,
+        model: MinecraftModel,
+        textures_bindings: TextureBindings,
+        tints: list[TintSource],
+    ):
         if model.gui_light == "side":
             activate_light = GL_LIGHT0
             deactivate_light = GL_LIGHT1
@@ -453,21 +524,9 @@ class GenericModelRenderTask(Task):
             uv = [x / 16 for x in uv]
         assert len(uv) == 4
 
-        match face:
-            case "down":
-                vertices_order = [7, 6, 1, 0]
-            case "up":
-                vertices_order = [3, 2, 5, 4]
-            case "south":
-                vertices_order = [4, 5, 6, 7]
-            case "north":
-                vertices_order = [2, 3, 0, 1]
-            case "east":
-                vertices_order = [5, 2, 1, 6]
-            case "west":
-                vertices_order = [3, 4, 7, 0]
-            case _:
-                raise RenderError(f"Unknown face {face}")
+        if face not in FACE_VERTICES_ORDER:
+            raise RenderError(f"Unknown face {face}")
+        vertices_order = list(FACE_VERTICES_ORDER[face])
 
         match data.rotation:
             case 0:
@@ -519,6 +578,24 @@ class GenericModelRenderTask(Task):
 
         glEnable(GL_TEXTURE_2D)
 
+        # Animated textures stay whole in GL, the texture matrix selects the frame.
+        # A face sampling outside of a frame would bleed on its neighbours, it uses the single frame instead
+        frame = self.animation_frames.get(bindings[1])
+        if frame is not None:
+            index, count = frame
+            if min(uv[1], uv[3]) < 0 or max(uv[1], uv[3]) > 1:
+                bindings = (
+                    ((self.get_frame_texture_id(bindings[1], index), None),),
+                    bindings[1],
+                )
+                frame = None
+            else:
+                glMatrixMode(GL_TEXTURE)
+                glLoadIdentity()
+                glTranslatef(0, index / count, 0)
+                glScalef(1, 1 / count, 1)
+                glMatrixMode(GL_MODELVIEW)
+
         # Save current blend function
         blend_src = glGetIntegerv(GL_BLEND_SRC)
         blend_dst = glGetIntegerv(GL_BLEND_DST)
@@ -559,6 +636,11 @@ class GenericModelRenderTask(Task):
         # Restore previous blend function
         glBlendFunc(blend_src, blend_dst)
 
+        if frame is not None:
+            glMatrixMode(GL_TEXTURE)
+            glLoadIdentity()
+            glMatrixMode(GL_MODELVIEW)
+
         glDisable(GL_TEXTURE_2D)
 
     def get_uv(
@@ -643,19 +725,29 @@ class Animation:
         self.cache_texture_animated = texture_animated
         return texture_animated
 
+    def iter_ticks(
+        self,
+        texture_animated: dict[str, tuple[list[int], bool]],
+        period: int,
+    ) -> Iterator[dict[str, int]]:
+        for i in range(period):
+            yield {
+                texture_path: frames[i % len(frames)]
+                for texture_path, (frames, interpolated) in texture_animated.items()
+            }
+
     def get_tick_grouped(
         self,
         texture_animated: dict[str, tuple[list[int], bool]],
     ) -> list[TickGrouped]:
-        total_number_of_tick = np.lcm.reduce(
-            [len(frames[0]) for frames in texture_animated.values()]
-        )
-        ticks = []
-        for i in range(total_number_of_tick):
-            current_tick = {}
-            for texture_path, (frames, interpolated) in texture_animated.items():
-                current_tick[texture_path] = frames[i % len(frames)]
-            ticks.append(current_tick)
+        opts = self.getter.opts
+        period = lcm(*(len(frames[0]) for frames in texture_animated.values()))
+        if period > opts.max_animation_ticks:
+            log.warning(
+                f"Animation of {self.source} loops every {period} ticks, "
+                f"only the first {opts.max_animation_ticks} ticks are rendered"
+            )
+            period = opts.max_animation_ticks
 
         is_interpolated = any(
             texture_animated[texture_path][1]
@@ -663,13 +755,19 @@ class Animation:
         )
 
         ticks_grouped: list[TickGrouped] = []
-        for tick in ticks:
+        for tick in self.iter_ticks(texture_animated, period):
             if (
                 len(ticks_grouped) > 0
                 and ticks_grouped[-1].tick == tick
                 and not is_interpolated
             ):
                 ticks_grouped[-1].duration += 1
+            elif len(ticks_grouped) >= opts.max_animation_frames:
+                log.warning(
+                    f"Animation of {self.source} has more than {opts.max_animation_frames} frames, "
+                    f"it is truncated after {sum(tick.duration for tick in ticks_grouped)} ticks"
+                )
+                break
             else:
                 ticks_grouped.append(TickGrouped(tick=tick, duration=1))
 
@@ -681,7 +779,15 @@ class Animation:
 
     def get_frames(
         self,
-    ) -> Generator[tuple[int, tuple[dict[str, Image.Image], int]], None, None]:
+    ) -> Generator[
+        tuple[int, tuple[dict[str, Image.Image], dict[str, tuple[int, float]], int]],
+        None,
+        None,
+    ]:
+        """
+        Yields for each frame the blended images of interpolated textures,
+        the frame shown by the other animated textures and the frame duration.
+        """
         if not self.is_animated:
             raise RenderError("Should not be called if is_animated is False")
         texture_animated = self.get_texture_animated()
@@ -691,21 +797,18 @@ class Animation:
         ticks_grouped = self.get_tick_grouped(texture_animated)
 
         for i, tick in enumerate(ticks_grouped):
-            images = self.get_images(tick, texture_animated)
-            yield i, (images, tick.duration)
+            images, frames = self.get_images(tick, texture_animated)
+            yield i, (images, frames, tick.duration)
 
     def get_images(
         self, tick: TickGrouped, texture_animated: dict[str, tuple[list[int], bool]]
-    ) -> dict[str, Image.Image]:
-        images = {}
+    ) -> tuple[dict[str, Image.Image], dict[str, tuple[int, float]]]:
+        images: dict[str, Image.Image] = {}
+        frames: dict[str, tuple[int, float]] = {}
         for texture_path, index in tick.tick.items():
-            texture = self.texture(texture_path)
-            if not texture:
-                raise RenderError(f"WTF")
-            img: Image.Image = texture.image
-            cropped = img.crop(
-                (0, index * img.width, img.width, (index + 1) * img.width)
-            )
+            img = self.getter.get_image(resolve_key(texture_path))
+            if img is None:
+                raise RenderError(f"Animated texture {texture_path} not found")
             if texture_animated[texture_path][1]:
                 lenght = 0
                 current_index = index
@@ -731,44 +834,47 @@ class Animation:
                     assert tick_after is not None
                     lenght += 1
                 if lenght > 1:
-                    next_cropped = img.crop(
-                        (
-                            0,
-                            next_index * img.width,
-                            img.width,
-                            (next_index + 1) * img.width,
-                        )
-                    )
                     t = left_lenght / (lenght)
-                    cropped = self.blend_images(cropped, next_cropped, t)
-            images[texture_path] = cropped
-        return images
+                    # the same frame pair and progress come back at every period
+                    images[texture_path] = self.getter.decoded_textures.get(
+                        ("blend", f"{texture_path}|{index}|{next_index}|{t}"),
+                        img,
+                        partial(self.blend_frames, img, index, next_index, t),
+                    )
+                    continue
+            frames[resolve_key(texture_path)] = (index, img.height / img.width)
+        return images, frames
 
     @staticmethod
-    def blend_images(img1: Image.Image, img2: Image.Image, t: float) -> Image.Image:
-        def lerp(a: int, b: int, t: float) -> int:
-            return int(a * (1 - t) + b * t)
+    def frame_key(
+        images: dict[str, Image.Image], frames: dict[str, tuple[int, float]]
+    ) -> tuple:
+        """Identifies the content of a frame, equal frames render the same image."""
+        return tuple(sorted(frames.items())) + tuple(
+            (path, img.size, img.tobytes()) for path, img in sorted(images.items())
+        )
 
+    @staticmethod
+    def crop_frame(img: Image.Image, index: int) -> Image.Image:
+        return img.crop((0, index * img.width, img.width, (index + 1) * img.width))
+
+    @classmethod
+    def blend_frames(
+        cls, img: Image.Image, index: int, next_index: int, t: float
+    ) -> Image.Image:
+        return cls.blend_images(
+            cls.crop_frame(img, index), cls.crop_frame(img, next_index), t
+        )
+
+    @staticmethod
+    def blend_images(img1: Image.Image, img2: Image.Image, t: float) -> Image.Image:
         assert img1.size == img2.size
         assert t >= 0 and t <= 1
-        img1 = img1.convert("RGBA")
-        img2 = img2.convert("RGBA")
-        result = Image.new("RGBA", img1.size)
-        for x in range(img1.width):
-            for y in range(img1.height):
-                pixel1 = img1.getpixel((x, y))
-                pixel2 = img2.getpixel((x, y))
-                assert isinstance(pixel1, tuple) and isinstance(pixel2, tuple)
-                assert len(pixel1) == 4 and len(pixel2) == 4
-                # Blend the pixels using alpha blending
-                blended_pixel = (
-                    lerp(pixel1[0], pixel2[0], t),
-                    lerp(pixel1[1], pixel2[1], t),
-                    lerp(pixel1[2], pixel2[2], t),
-                    lerp(pixel1[3], pixel2[3], t),
-                )
-                result.putpixel((x, y), blended_pixel)
-        return result
+        pixels1 = np.asarray(img1.convert("RGBA"), dtype=np.float64)
+        pixels2 = np.asarray(img2.convert("RGBA"), dtype=np.float64)
+        # truncated like int(a * (1 - t) + b * t)
+        blended = pixels1 * (1 - t) + pixels2 * t
+        return Image.fromarray(blended.astype(np.uint8))
 
     def texture(self, key: str) -> Optional[Texture]:
         return self.getter.assets.textures.get(resolve_key(key))
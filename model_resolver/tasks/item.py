@@ -1,15 +1,25 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from typing import Optional
+import json
+import os
+from beet import JsonFile
+from typing import Any, Optional
 from model_resolver.tasks.model import AnimatedResultTask
 from model_resolver.minecraft_model import (
     MinecraftModel,
 )
-from model_resolver.item_model.model import ItemModel
+from model_resolver.item_model.model import (
+    ItemModel,
+    ResolvedLeaf,
+    apply_component_patch,
+    get_leaves_key,
+    resolve_item_model,
+)
 from model_resolver.item_model.tint_source import TintSource
-from typing import Generator
+from typing import Generator, Hashable
 from model_resolver.tasks.generic_render import Animation, GenericModelRenderTask
-from model_resolver.tasks.base import Task, RenderError
+from model_resolver.tasks.base import Task, RenderError, share_render
+from model_resolver.utils import log, resolve_key
 
 
 @dataclass(kw_only=True)
@@ -24,11 +34,16 @@ class ItemModelModelRenderTask(GenericModelRenderTask):
         for model, tints in self.models:
             self.render_model(model, tints, self.source)
 
+    def get_render_key(self) -> Optional[Hashable]:
+        return self.get_leaves_render_key(
+            [(model, tints, None) for model, tints in self.models]
+        )
+
 
 @dataclass(kw_only=True)
 class ItemRenderTask(GenericModelRenderTask):
 
-    def get_parsed_item_model(self) -> ItemModel:
+    def get_item_model_key(self) -> str:
         assert self.item
         assert self.item.__resolved__, f"Item {self.item.id} is not resolved"
         assert self.item.components, f"Item {self.item.id} has no components"
@@ -38,52 +53,64 @@ class ItemRenderTask(GenericModelRenderTask):
         item_model_key = self.item.components["minecraft:item_model"]
         if not item_model_key:
             raise RenderError(f"Item {self.item} does not have a model")
-        if item_model_key in self.getter.assets.item_models:
-            item_model = self.getter.assets.item_models[item_model_key]
-        else:
+        return item_model_key
+
+    def get_parsed_item_model(self) -> ItemModel:
+        item_model_key = self.get_item_model_key()
+        item_model = ItemModel.from_key(self.getter, item_model_key)
+        if item_model is None:
             raise RenderError(f"Item model {item_model_key} not found")
-        return ItemModel.model_validate(item_model.data)
+        return item_model
+
+    def get_leaves(self) -> list[ResolvedLeaf]:
+        item_model_key = self.get_item_model_key()
+        leaves = resolve_item_model(self.getter, item_model_key, self.item)
+        if leaves is None:
+            raise RenderError(f"Item model {item_model_key} not found")
+        return leaves
+
+    def get_render_key(self) -> Optional[Hashable]:
+        return self.get_leaves_render_key(self.get_leaves())
 
     def run(self):
-        parsed_item_model = self.get_parsed_item_model()
-        for model in parsed_item_model.resolve(self.getter, self.item):
-            model_def = model.get_model(self.getter, self.item).bake()
+        for model_def, tints, transformation in self.get_leaves():
             self.render_model(
                 model_def,
-                model.get_tints(self.getter, self.item),
+                tints,
                 source=str(self.item),
-                transformation=model.transformation,
+                transformation=transformation,
             )
 
-    def resolve(self) -> Generator[Task, None, None]:
-        parsed_item_model = self.get_parsed_item_model()
-        item_model_models = list(parsed_item_model.resolve(self.getter, self.item))
-
-        animation = Animation(
-            textures=[
-                model.get_model(self.getter, self.item).bake().textures
-                for model in item_model_models
-            ],
+    def get_animation(self, leaves: list[ResolvedLeaf]) -> Animation:
+        return Animation(
+            textures=[model_def.textures for model_def, _, _ in leaves],
             getter=self.getter,
             animation_framerate=self.animation_framerate,
             source=str(self.item),
         )
+
+    def resolve(self) -> Generator[Task, None, None]:
+        leaves = self.get_leaves()
+
+        animation = self.get_animation(leaves)
         if not animation.is_animated:
             self.animation_mode = "multi_files"
             yield self
             return
 
         tasks = []
-
-        for i, (images, duration) in animation.get_frames():
-            # get the images for the tick
-            models: list[tuple[MinecraftModel, list[TintSource]]] = []
-            for model in item_model_models:
-                model_def = model.get_model(self.getter, self.item).bake()
-                model_def = model_def.model_copy()
-                textures = self.get_textures(model_def, images)
-                model_def.textures = textures
-                models.append((model_def, model.get_tints(self.getter, self.item)))
+        renders: dict[Hashable, Task] = {}
+
+        baked_models = [(model_def, tints) for model_def, tints, _ in leaves]
+        for i, (images, frames, duration) in animation.get_frames():
+            # only blended frames need their own textures, others select a frame of the uploaded texture
+            models: list[tuple[MinecraftModel, list[TintSource]]] = baked_models
+            if images:
+                models = []
+                for model_def, tints in baked_models:
+                    model_def = model_def.model_copy()
+                    model_def.textures = self.get_textures(model_def, images)
+                    models.append((model_def, tints))
 
             if self.path_save:
                 new_path_save = self.path_save / "{i:{animated_path_padding}]}_{duration}.png".format(
@@ -122,7 +149,9 @@ class ItemRenderTask(GenericModelRenderTask):
                 dynamic_textures=self.dynamic_textures,
                 source=str(self.item),
                 animation_duration=duration,
+                animation_frames=frames,
             )
+            share_render(task, Animation.frame_key(images, frames), renders)
             yield task
             tasks.append(task)
 
@@ -140,3 +169,79 @@ class ItemRenderTask(GenericModelRenderTask):
                 animation_mode=self.animation_mode,
                 animation_framerate=self.animation_framerate,
             )
+
+
+@dataclass(kw_only=True)
+class ItemVariantsRenderTask(ItemRenderTask):
+    """
+    Renders every variant of an item model, the reachable leaves of its tree,
+    once per distinct set of leaves. `path_ctx` and `path_save` are directories,
+    the manifest maps the components selecting each variant to the path of its
+    render relative to them, see get_render_path.
+    """
+
+    manifest: list[dict[str, Any]] = field(default_factory=list)
+
+    def resolve(self) -> Generator[Task, None, None]:
+        assert self.item
+        item_model_key = self.get_item_model_key()
+        renders: dict[str, str] = {}
+        for patch in self.get_parsed_item_model().iter_patches():
+            variant = self.item.model_copy(
+                update={
+                    "components_from_user": apply_component_patch(
+                        self.item.components_from_user, patch
+                    )
+                }
+            )
+            variant.__resolved__ = self.item.__resolved__
+            leaves = resolve_item_model(self.getter, item_model_key, variant)
+            if leaves is None:
+                raise RenderError(f"Item model {item_model_key} not found")
+            key = get_leaves_key(leaves)
+            render = renders.get(key)
+            if render is None:
+                task = ItemRenderTask(
+                    getter=self.getter,
+                    item=variant,
+                    render_size=self.render_size,
+                    animation_mode=self.animation_mode,
+                    animation_framerate=self.animation_framerate,
+                    animated_path_padding=self.animated_path_padding,
+                )
+                render = renders[key] = self.get_render_path(
+                    str(len(renders)), task.get_animation(leaves).is_animated
+                )
+                if self.path_ctx:
+                    task.path_ctx = f"{self.path_ctx}/{render.removesuffix('/')}"
+                if self.path_save:
+                    task.path_save = self.path_save / render.removesuffix("/")
+                yield from task.resolve()
+            self.manifest.append(
+                {"components": apply_component_patch({}, patch), "render": render}
+            )
+        log.info(
+            f"{len(self.manifest)} variants of {item_model_key} rendered as {len(renders)} images"
+        )
+        self.save_manifest()
+
+    def get_render_path(self, name: str, is_animated: bool) -> str:
+        """Where a render is saved, relative to the directory: a file, or a directory of frames ending with /."""
+        if is_animated and self.animation_mode == "multi_files":
+            return f"{name}/"
+        if self.path_ctx:
+            return name
+        if is_animated and self.animation_mode == "webp":
+            return f"{name}.webp"
+        return f"{name}.png"
+
+    def save_manifest(self):
+        if self.path_ctx:
+            namespace, path = resolve_key(self.path_ctx).split(":", 1)
+            self.getter._ctx.assets[namespace].extra[
+                f"textures/{path}/manifest.json"
+            ] = JsonFile(self.manifest)
+        elif self.path_save:
+            os.makedirs(self.path_save, exist_ok=True)
+            with open(self.path_save / "manifest.json", "w") as f:
+                json.dump(self.manifest, f, indent=4)
@@ -8,8 +8,8 @@ from model_resolver.minecraft_model import (
     MinecraftModel,
     resolve_model,
 )
-from typing import ClassVar, Generator
-from model_resolver.tasks.base import Task, RenderError
+from typing import ClassVar, Generator, Hashable
+from model_resolver.tasks.base import Task, RenderError, share_render
 from model_resolver.tasks.generic_render import Animation, GenericModelRenderTask
 from model_resolver.item_model.tint_source import TintSource
 from PIL import Image
@@ -22,16 +22,27 @@ class ModelRenderTask(GenericModelRenderTask):
     tints: list[TintSource] = field(default_factory=list)
     item: Item = field(default_factory=lambda: Item(id="do_not_use"))
     source: Optional[str] = None
+    # the model baked once, for the render key and the render
+    baked_model: Optional[MinecraftModel] = None
 
     def resolve(self) -> Generator[Task, None, None]:
         yield self
 
+    def get_baked_model(self) -> MinecraftModel:
+        if self.baked_model is None:
+            self.baked_model = self.model.bake()
+        return self.baked_model
+
     def run(self):
-        self.render_model(self.model.bake(), self.tints, self.source)
+        self.render_model(self.get_baked_model(), self.tints, self.source)
+
+    def get_render_key(self) -> Optional[Hashable]:
+        return self.get_leaves_render_key([(self.get_baked_model(), self.tints, None)])
 
     def flush(self):
         super().flush()
         self.model = MinecraftModel()
+        self.baked_model = None
         self.tints = []
         self.item = Item(id="do_not_use")
 
@@ -75,6 +86,7 @@ class AnimatedResultTask(Task):
             self.getter._ctx.assets[TextureWebP][self.path_ctx] = TextureWebP(
                 data.getvalue()
             )
+            self.getter.invalidate(TextureWebP, self.path_ctx)
         elif self.path_save:
             images.sort(key=lambda x: int(x[2].name.split("_")[0]))
             images_duration: list[Image.Image] = []
@@ -113,6 +125,8 @@ class ModelPathRenderTask(GenericModelRenderTask):
     model: str
     tints: list[TintSource] = field(default_factory=list)
     item: Item = field(default_factory=lambda: Item(id="do_not_use"))
+    # the model resolved and baked once, for resolve, the render key and the render
+    parsed_model: Optional[MinecraftModel] = None
 
     def run(self):
         if len(self.tints) > 0:
@@ -120,13 +134,23 @@ class ModelPathRenderTask(GenericModelRenderTask):
         model = self.get_parsed_model()
         self.render_model(model, self.tints, self.model)
 
+    def get_render_key(self) -> Optional[Hashable]:
+        return self.get_leaves_render_key([(self.get_parsed_model(), self.tints, None)])
+
     def get_parsed_model(self) -> MinecraftModel:
+        if self.parsed_model is not None:
+            return self.parsed_model
         model = self.getter.assets.models.get(self.model)
         if not model:
             raise RenderError(f"Model {self.model} not found")
-        return MinecraftModel.model_validate(
+        self.parsed_model = MinecraftModel.model_validate(
             resolve_model(model.data, self.getter)
         ).bake()
+        return self.parsed_model
+
+    def flush(self):
+        super().flush()
+        self.parsed_model = None
 
     def resolve(self) -> Generator[Task, None, None]:
         model = self.get_parsed_model()
@@ -147,12 +171,14 @@ class ModelPathRenderTask(GenericModelRenderTask):
             return
 
         tasks = []
-
-        for i, (images, duration) in animation.get_frames():
-            # get the images for the tick
-            textures = self.get_textures(model, images)
-            new_model = model.model_copy()
-            new_model.textures = textures
+        renders: dict[Hashable, Task] = {}
+
+        for i, (images, frames, duration) in animation.get_frames():
+            # only blended frames need their own textures, others select a frame of the uploaded texture
+            new_model = model
+            if images:
+                new_model = model.model_copy()
+                new_model.textures = self.get_textures(model, images)
             if self.path_save:
                 new_path_save = self.path_save / "{i:{animated_path_padding}]}_{duration}.png".format(
                     i = i,
@@ -191,7 +217,9 @@ class ModelPathRenderTask(GenericModelRenderTask):
                 dynamic_textures=self.dynamic_textures,
                 source=self.model,
                 animation_duration=duration,
+                animation_frames=frames,
             )
+            share_render(task, Animation.frame_key(images, frames), renders)
             yield task
             tasks.append(task)
             if self.animation_mode == "one_file":
@@ -3,10 +3,16 @@ from OpenGL.GLUT import *  # pyright: ignore[reportWildcardImportFromLibrary]
 from OpenGL.GLU import *  # pyright: ignore[reportWildcardImportFromLibrary]
 
 from dataclasses import dataclass, field
+import numpy as np
 from model_resolver.item_model.item import Item
 from model_resolver.item_model.special import SpecialModelShulkerBox
 from model_resolver.item_model.tint_source import TintSource, TintSourceConstant
-from model_resolver.tasks.generic_render import Animation, GenericModelRenderTask
+from model_resolver.tasks.generic_render import (
+    FACE_VERTICES_ORDER,
+    Animation,
+    GenericModelRenderTask,
+    TextureBindings,
+)
 from model_resolver.utils import ModelResolverOptions, resolve_key
 from model_resolver.minecraft_model import (
     DisplayOptionModel,
@@ -16,41 +22,153 @@ from model_resolver.minecraft_model import (
     TextureSource,
     resolve_model,
 )
-from typing import Generator, Optional, Any, TypedDict, Union
+from typing import (
+    Callable,
+    Generator,
+    Hashable,
+    Iterator,
+    Literal,
+    Mapping,
+    Optional,
+    Any,
+    TypedDict,
+    Union,
+)
 from pydantic import BaseModel, Field
 from functools import cached_property
 import random
-from model_resolver.tasks.base import Task, RenderError
-from model_resolver.tasks.model import AnimatedResultTask, ModelRenderTask
+from model_resolver.tasks.base import Task, RenderError, share_render
+from model_resolver.tasks.model import AnimatedResultTask
 from PIL import Image
 
 
+type LevelOfDetail = Literal["auto", "full", "voxel", "heightmap"]
+
+
+# Corners of a unit cube, in the same order as GenericModelRenderTask.get_vertices
+CUBE_CORNERS = np.array(
+    [
+        [0, 0, 0],
+        [1, 0, 0],
+        [1, 1, 0],
+        [0, 1, 0],
+        [0, 1, 1],
+        [1, 1, 1],
+        [1, 0, 1],
+        [0, 0, 1],
+    ],
+    dtype=np.float32,
+)
+
+FACE_DIRECTIONS: dict[str, tuple[int, int, int]] = {
+    "down": (0, -1, 0),
+    "up": (0, 1, 0),
+    "north": (0, 0, -1),
+    "south": (0, 0, 1),
+    "west": (-1, 0, 0),
+    "east": (1, 0, 0),
+}
+
+
+def get_face_normal(face: str) -> np.ndarray:
+    v0, v1, v2, _ = CUBE_CORNERS[list(FACE_VERTICES_ORDER[face])]
+    return np.cross(v1 - v0, v2 - v0)
+
+
+def build_box_quads(
+    mins: np.ndarray,
+    sizes: np.ndarray,
+    colors: np.ndarray,
+    faces: dict[str, np.ndarray],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Builds vertex, normal and color arrays (one row per vertex) for GL_QUADS,
+    from boxes defined by their min corner and size. `faces` maps each face
+    to a mask of the boxes where this face is drawn.
+    """
+    vertices: list[np.ndarray] = []
+    normals: list[np.ndarray] = []
+    vertex_colors: list[np.ndarray] = []
+    for face, mask in faces.items():
+        count = int(np.count_nonzero(mask))
+        if count == 0:
+            continue
+        corners = CUBE_CORNERS[list(FACE_VERTICES_ORDER[face])]
+        quads = mins[mask][:, None, :] + corners[None, :, :] * sizes[mask][:, None, :]
+        vertices.append(quads.reshape(-1, 3))
+        normals.append(np.tile(get_face_normal(face), (count * 4, 1)))
+        vertex_colors.append(np.repeat(colors[mask], 4, axis=0))
+    if len(vertices) == 0:
+        return (
+            np.zeros((0, 3), dtype=np.float32),
+            np.zeros((0, 3), dtype=np.float32),
+            np.zeros((0, 4), dtype=np.float32),
+        )
+    return (
+        np.ascontiguousarray(np.concatenate(vertices), dtype=np.float32),
+        np.ascontiguousarray(np.concatenate(normals), dtype=np.float32),
+        np.ascontiguousarray(np.concatenate(vertex_colors), dtype=np.float32),
+    )
+
+
 class PaletteModel(BaseModel):
     Name: str
     Properties: dict[str, str] = Field(default_factory=dict)
 
 
-class BlockModel(BaseModel):
-    state: int
-    pos: tuple[int, int, int]
-    nbt: Optional[dict[str, Any]] = None
-
+@dataclass
+class StructureData:
+    """
+    Blocks of a structure stored as compact arrays.
+    Block entities NBT is kept aside, indexed by block index.
+    """
 
-class StructureDataModel(BaseModel):
-    DataVersion: int
     size: tuple[int, int, int]
-    palette_: Optional[list[PaletteModel]] = Field(alias="palette", default=None)
-    palettes: Optional[list[list[PaletteModel]]] = None
-    blocks: list[BlockModel]
-    entities: Any
+    palette: list[PaletteModel]
+    positions: np.ndarray
+    states: np.ndarray
+    block_entities: dict[int, dict[str, Any]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    @classmethod
+    def from_nbt(cls, data: Mapping[str, Any], seed: int = 0) -> "StructureData":
+        size = (int(data["size"][0]), int(data["size"][1]), int(data["size"][2]))
+        if "palette" in data:
+            raw_palette = data["palette"]
+        elif "palettes" in data and len(data["palettes"]) > 0:
+            raw_palette = random.Random(seed).choice(data["palettes"])
+        else:
+            raise RenderError("No palette found")
+        palette = [PaletteModel.model_validate(x) for x in raw_palette]
+
+        blocks = data.get("blocks", [])
+        dtype = np.int16 if max(size) < 2**15 else np.int32
+        positions = np.array(
+            [block["pos"] for block in blocks], dtype=dtype
+        ).reshape(-1, 3)
+        states = np.fromiter(
+            (block["state"] for block in blocks), dtype=np.int32, count=len(blocks)
+        )
+        block_entities = {
+            i: block["nbt"] for i, block in enumerate(blocks) if "nbt" in block
+        }
+        return cls(
+            size=size,
+            palette=palette,
+            positions=positions,
+            states=states,
+            block_entities=block_entities,
+        )
 
-    @cached_property
-    def palette(self) -> list[PaletteModel]:
-        if self.palette_:
-            return self.palette_
-        if self.palettes:
-            return random.choice(self.palettes)
-        raise RenderError("No palette found")
+    def iter_blocks(self) -> Iterator[tuple[int, tuple[int, int, int]]]:
+        """Yields (palette state, position) for every block."""
+        for state, (x, y, z) in zip(self.states.tolist(), self.positions.tolist()):
+            yield state, (x, y, z)
+
+    def unique_states(self) -> list[int]:
+        return np.unique(self.states).tolist()
 
 
 class VariantModel(BaseModel):
@@ -64,6 +182,57 @@ class VariantModel(BaseModel):
 Variant = Union[VariantModel, list[VariantModel]]
 
 
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _to_long(value: int) -> int:
+    value &= MASK_64
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_int(value: int) -> int:
+    value &= 0xFFFFFFFF
+    return value - (1 << 32) if value >= (1 << 31) else value
+
+
+def _mix_64(value: int) -> int:
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+def get_position_seed(x: int, y: int, z: int) -> int:
+    """Same as Minecraft's Mth.getSeed, used for positional randomness."""
+    # x * 3129871 is an int product in Java, only widened to a long afterwards
+    seed = _to_long(_to_int(x * 3129871) ^ _to_long(z * 116129781) ^ y)
+    seed = _to_long(seed * seed * 42317861 + seed * 11)
+    return seed >> 16
+
+
+def positional_random(
+    seed: int, pos: tuple[int, int, int], state: int, part: int = 0
+) -> float:
+    """
+    Returns a float in [0, 1) derived only from the seed, the block position,
+    the palette state and the multipart index.
+    """
+    value = _mix_64(seed & MASK_64)
+    value = _mix_64(value ^ (get_position_seed(*pos) & MASK_64))
+    value = _mix_64(value ^ ((part << 32) | (state & 0xFFFFFFFF)))
+    return (value >> 11) / (1 << 53)
+
+
+def choose_variant(variants: list[VariantModel], value: float) -> VariantModel:
+    """Weighted choice of a variant, value being a float in [0, 1)."""
+    target = value * sum(x.weight for x in variants)
+    for variant in variants:
+        target -= variant.weight
+        if target < 0:
+            return variant
+    return variants[-1]
+
+
 SimpleWhenCondition = dict[str, str]
 
 HardWhenCondition = TypedDict(
@@ -78,34 +247,91 @@ HardWhenCondition = TypedDict(
 WhenCondition = HardWhenCondition | SimpleWhenCondition
 
 
-def verify_when(when: WhenCondition, block_state: dict[str, Any]) -> bool:
+type WhenPredicate = Callable[[Mapping[str, Any]], bool]
+
+
+def compile_when(when: WhenCondition) -> WhenPredicate:
+    """
+    Compile a multipart `when` condition into a predicate over block state properties.
+    Values like "a|b|c" are split once into a set, OR / AND are short-circuited.
+    """
     if "OR" in when:
         conditions = when["OR"]
         assert isinstance(conditions, list)
-        return any([verify_when(x, block_state) for x in conditions])
+        or_predicates = tuple(compile_when(x) for x in conditions)
+        return lambda block_state: any(p(block_state) for p in or_predicates)
     if "AND" in when:
         conditions = when["AND"]
         assert isinstance(conditions, list)
-        return all([verify_when(x, block_state) for x in conditions])
+        and_predicates = tuple(compile_when(x) for x in conditions)
+        return lambda block_state: all(p(block_state) for p in and_predicates)
+
+    tests = tuple(
+        (key, frozenset(str(value).split("|"))) for key, value in when.items()
+    )
 
-    for key, value in when.items():
-        if not key in block_state:
-            return False
-        values = str(value).split("|")
-        if not any([str(block_state[key]) == x for x in values]):
-            return False
-    return True
+    def predicate(block_state: Mapping[str, Any]) -> bool:
+        for key, values in tests:
+            if not key in block_state:
+                return False
+            if str(block_state[key]) not in values:
+                return False
+        return True
+
+    return predicate
+
+
+def verify_when(when: WhenCondition, block_state: dict[str, Any]) -> bool:
+    return compile_when(when)(block_state)
 
 
 class MultiPartModel(BaseModel):
     apply: Variant
     when: Optional[WhenCondition] = None
 
+    @cached_property
+    def predicate(self) -> WhenPredicate:
+        if not self.when:
+            return lambda block_state: True
+        return compile_when(self.when)
+
 
 class BlockState(BaseModel):
     variants: Optional[dict[str, Variant]] = None
     multipart: Optional[list[MultiPartModel]] = None
 
+    @cached_property
+    def parsed_variants(self) -> list[tuple[dict[str, str], Variant]]:
+        res: list[tuple[dict[str, str], Variant]] = []
+        if not self.variants:
+            return res
+        for key, variant in self.variants.items():
+            if key == "":
+                continue
+            parsed_key: dict[str, str] = {}
+            for key_split_part in key.split(","):
+                state, value = key_split_part.split("=")
+                parsed_key[state] = value
+            res.append((parsed_key, variant))
+        return res
+
+    def get_variants(self, properties: Mapping[str, str]) -> list[Variant]:
+        """Returns the variants to render for the given block state properties."""
+        if self.variants:
+            variant = self.variants.get("")
+            for parsed_key, candidate in self.parsed_variants:
+                if all(properties.get(x) == y for x, y in parsed_key.items()):
+                    variant = candidate
+                    break
+            if variant is None:
+                raise RenderError(
+                    f"Variant not found {list(self.variants.keys())=}, {properties=}"
+                )
+            return [variant]
+        if self.multipart:
+            return [part.apply for part in self.multipart if part.predicate(properties)]
+        return []
+
     def get_models(self):
         if self.variants:
             for variant in self.variants.values():
@@ -139,12 +365,32 @@ class StructureRenderTask(GenericModelRenderTask):
     images_override: Optional[dict[str, Image.Image]] = None
     item: Item = field(default_factory=lambda: Item(id="do_not_use"))
 
+    block_states: dict[str, BlockState] = field(default_factory=dict)
+    palette_variants: dict[int, list[Variant]] = field(default_factory=dict)
+
+    parsed_models: dict[str, MinecraftModel] = field(default_factory=dict)
+    block_tints: dict[tuple[str, int], list[TintSource]] = field(default_factory=dict)
+    variant_rotations: dict[tuple[int, int], list[RotationModel]] = field(
+        default_factory=dict
+    )
+    # Texture bindings of each drawn model, by model id
+    model_bindings: dict[int, tuple[MinecraftModel, TextureBindings]] = field(
+        default_factory=dict
+    )
+
+    level_of_detail: LevelOfDetail = "auto"
+    # Under this projected block size (in pixels), "auto" draws blocks as voxels
+    lod_block_size: float = 2.0
+    average_colors: dict[int, Optional[tuple[float, float, float, float]]] = field(
+        default_factory=dict
+    )
+
     @cached_property
     def structure(self):
         structure = self.getter.data.structures.get(self.structure_key)
         if structure is None:
             raise RenderError(f"Structure {self.structure_key} not found")
-        return StructureDataModel.model_validate(structure.data)
+        return StructureData.from_nbt(structure.data, self.random_seed)
 
     def rotate_camera(self):
         if not self.do_rotate_camera:
@@ -162,37 +408,94 @@ class StructureRenderTask(GenericModelRenderTask):
         glRotatef(rotation[2], 0, 0, 1)
         glScalef(scale[0], scale[1], scale[2])
 
+    @property
+    def block_pixel_size(self) -> float:
+        """Size in pixels of a block once projected on the rendered image."""
+        scale = max(abs(x) for x in self.display_option.scale or (1, 1, 1))
+        return 16 * scale * self.render_size / (2 * self.zoom)
+
+    @cached_property
+    def resolved_level_of_detail(self) -> LevelOfDetail:
+        if self.level_of_detail != "auto":
+            return self.level_of_detail
+        if self.block_pixel_size < self.lod_block_size:
+            return "voxel"
+        return "full"
+
     def run(self):
-        random.seed(self.random_seed)
         self.rotate_camera()
         sx, sy, sz = self.structure.size
         center = (sx / 2, sy / 2, sz / 2)
         center = (16 * center[0], 16 * center[1], 16 * center[2])
-        for block in self.structure.blocks:
-            self.render_block(block, center)
-        random.seed()
+        if self.resolved_level_of_detail in ("voxel", "heightmap"):
+            self.render_level_of_detail(center)
+            return
+        # blocks are drawn by this task, moving its offset and rotations
+        offset = self.offset
+        center_offset = self.center_offset
+        additional_rotations = self.additional_rotations
+        try:
+            for state, pos in self.structure.iter_blocks():
+                self.render_block(state, pos, center)
+        finally:
+            self.offset = offset
+            self.center_offset = center_offset
+            self.additional_rotations = additional_rotations
+            self.release_textures()
 
     def get_parsed_model(self, key: str) -> MinecraftModel:
+        if key in self.parsed_models:
+            return self.parsed_models[key]
         model = self.getter.assets.models.get(key)
         if not model:
             raise RenderError(f"Model {key} not found")
-        return MinecraftModel.model_validate(
+        res = MinecraftModel.model_validate(
             resolve_model(model.data, self.getter)
         ).bake()
+        self.parsed_models[key] = res
+        return res
 
     def get_all_textures(self) -> Generator[dict[str, TextureSource], None, None]:
-        for block in self.structure.blocks:
-            palleted = self.structure.palette[block.state]
-            block_state = self.getter.assets.blockstates.get(palleted.Name)
-            if block_state is None:
-                raise RenderError(f"Blockstate {palleted.Name} not found")
-            block_state = BlockState.model_validate(block_state.data)
+        for state in self.structure.unique_states():
+            palleted = self.structure.palette[state]
+            block_state = self.get_block_state(palleted.Name)
             for model_path in block_state.get_models():
                 assert isinstance(model_path, str), "Model path must be a string"
                 model = self.get_parsed_model(model_path)
                 yield model.textures
 
+    def get_block_state(self, name: str) -> BlockState:
+        if name in self.block_states:
+            return self.block_states[name]
+        block_state = self.getter.assets.blockstates.get(name)
+        if block_state is None:
+            raise RenderError(f"Blockstate {name} not found")
+        res = BlockState.model_validate(block_state.data)
+        self.block_states[name] = res
+        return res
+
+    def get_palette_variants(self, state: int) -> list[Variant]:
+        """
+        Returns the variants to render for a palette entry.
+        Palette entries are finite, so conditions are evaluated once per entry.
+        """
+        if state in self.palette_variants:
+            return self.palette_variants[state]
+        palleted = self.structure.palette[state]
+        if variant := self.render_special(palleted):
+            variants: list[Variant] = [variant]
+        else:
+            block_state = self.get_block_state(palleted.Name)
+            variants = block_state.get_variants(palleted.Properties)
+        self.palette_variants[state] = variants
+        return variants
+
     def resolve(self) -> Generator[Task, None, None]:
+        if self.resolved_level_of_detail in ("voxel", "heightmap"):
+            # Average colors are not animated
+            self.animation_mode = "multi_files"
+            yield self
+            return
         animation = Animation(
             textures=list(self.get_all_textures()),
             getter=self.getter,
@@ -205,8 +508,9 @@ class StructureRenderTask(GenericModelRenderTask):
             return
 
         tasks = []
+        renders: dict[Hashable, Task] = {}
 
-        for i, (images, duration) in animation.get_frames():
+        for i, (images, frames, duration) in animation.get_frames():
             if self.path_save:
                 new_path_save = self.path_save / "{i:{animated_path_padding}]}_{duration}.png".format(
                     i = i,
@@ -243,9 +547,18 @@ class StructureRenderTask(GenericModelRenderTask):
                 ensure_params=self.ensure_params,
                 dynamic_textures=self.dynamic_textures,
                 images_override=images,
+                animation_frames=frames,
                 animation_duration=duration,
                 display_option=self.display_option,
+                random_seed=self.random_seed,
+                block_states=self.block_states,
+                palette_variants=self.palette_variants,
+                level_of_detail=self.level_of_detail,
+                lod_block_size=self.lod_block_size,
+                parsed_models=self.parsed_models,
+                block_tints=self.block_tints,
             )
+            share_render(task, Animation.frame_key(images, frames), renders)
             yield task
             tasks.append(task)
             if self.animation_mode == "one_file":
@@ -446,105 +759,208 @@ class StructureRenderTask(GenericModelRenderTask):
                 model=model,
             )
 
-    def render_block(self, block: BlockModel, center: tuple[float, float, float]):
-        palleted = self.structure.palette[block.state]
-
-        block_state = self.getter.assets.blockstates.get(palleted.Name)
-        if variant := self.render_special(palleted):
-            return self.render_variant(variant, block, center, palleted)
-        if block_state is None:
-            raise RenderError(f"Blockstate {palleted.Name} not found")
-
-        block_state = BlockState.model_validate(block_state.data)
-        if block_state.variants:
-            variant = None
-            if "" in block_state.variants:
-                variant = block_state.variants[""]
-            parsed_dict: dict[str, dict[str, str]] = {}
-            for key in block_state.variants.keys():
-                if key == "": continue
-                parsed_key: dict[str, str] = {}
-                key_split = key.split(",")
-                for key_split_part in key_split:
-                    state, value = key_split_part.split("=")
-                    parsed_key[state] = value
-                parsed_dict[key] = parsed_key
-            for key, parsed_key in parsed_dict.items():
-                if all(
-                    [
-                        parsed_key.get(x, object())
-                        == palleted.Properties.get(x, object())
-                        for x in parsed_key.keys()
-                    ]
-                ):
-                    variant = block_state.variants[key]
-                    break
-            if variant is None:
-                raise RenderError(f"Variant not found {parsed_dict=}, {palleted.Properties=}")
-            self.render_variant(variant, block, center, palleted)
-        elif block_state.multipart:
-            for part in block_state.multipart:
-                if not part.when:
-                    self.render_variant(part.apply, block, center, palleted)
-                else:
-                    if verify_when(part.when, palleted.Properties):
-                        self.render_variant(part.apply, block, center, palleted)
+    def render_block(
+        self,
+        state: int,
+        pos: tuple[int, int, int],
+        center: tuple[float, float, float],
+    ):
+        for part, variant in enumerate(self.get_palette_variants(state)):
+            if isinstance(variant, list):
+                variant = choose_variant(
+                    variant, positional_random(self.random_seed, pos, state, part)
+                )
+            self.render_variant(variant, pos, center, state)
 
     def render_variant(
         self,
-        variant: Variant,
-        block: BlockModel,
+        resolved_variant: VariantModel,
+        pos: tuple[int, int, int],
         center: tuple[float, float, float],
-        palleted: PaletteModel,
+        state: int,
     ):
-        if isinstance(variant, list):
-            resolved_variant = random.choices(
-                variant, weights=[x.weight for x in variant]
-            )[0]
+        if isinstance(resolved_variant.model, str):
+            if resolve_key(resolved_variant.model) == "minecraft:block/air":
+                return
+            model = self.get_parsed_model(resolved_variant.model)
+            tints = self.get_block_tints(resolved_variant.model, state)
         else:
-            resolved_variant = variant
-        if (
-            isinstance(resolved_variant.model, str)
-            and resolve_key(resolved_variant.model) == "minecraft:block/air"
-        ):
-            return
+            model = resolved_variant.model.bake()
+            tints = []
 
+        self.offset = (pos[0] * 16, pos[1] * 16, pos[2] * 16)
+        self.center_offset = center
+        self.additional_rotations = self.get_variant_rotations(
+            resolved_variant.x, resolved_variant.y
+        )
+        self.draw_model(model, self.get_model_bindings(model), tints)
+
+    def get_variant_rotations(self, x: int, y: int) -> list[RotationModel]:
+        if (x, y) in self.variant_rotations:
+            return self.variant_rotations[(x, y)]
         rots: list[RotationModel] = [
-            SingleAxisRotationModel(
-                origin=(8, 8, 8), axis="x", angle=-resolved_variant.x, rescale=False
-            ),
-            SingleAxisRotationModel(
-                origin=(8, 8, 8), axis="y", angle=-resolved_variant.y, rescale=False
-            ),
+            SingleAxisRotationModel(origin=(8, 8, 8), axis="x", angle=-x, rescale=False),
+            SingleAxisRotationModel(origin=(8, 8, 8), axis="y", angle=-y, rescale=False),
         ]
-        tints = (
-            self.get_tints(resolved_variant.model, palleted)
-            if isinstance(resolved_variant.model, str)
-            else []
+        self.variant_rotations[(x, y)] = rots
+        return rots
+
+    def get_block_tints(self, model: str, state: int) -> list[TintSource]:
+        if (model, state) in self.block_tints:
+            return self.block_tints[(model, state)]
+        tints = self.get_tints(model, self.structure.palette[state])
+        self.block_tints[(model, state)] = tints
+        return tints
+
+    def get_model_bindings(self, model: MinecraftModel) -> TextureBindings:
+        """Textures of a model are uploaded once per structure render."""
+        if id(model) in self.model_bindings:
+            return self.model_bindings[id(model)][1]
+        bound_model = model
+        if self.images_override:
+            bound_model = model.model_copy()
+            bound_model.textures = self.get_textures(model, self.images_override)
+        bindings = self.generate_textures_bindings(bound_model, self.structure_key)
+        self.model_bindings[id(model)] = (model, bindings)
+        return bindings
+
+    def release_textures(self):
+        super().release_textures()
+        self.model_bindings = {}
+
+    def get_average_color(
+        self, state: int
+    ) -> Optional[tuple[float, float, float, float]]:
+        """Average RGBA color of a palette entry, None if nothing is drawn."""
+        if state in self.average_colors:
+            return self.average_colors[state]
+        palleted = self.structure.palette[state]
+        color = None
+        for variant in self.get_palette_variants(state):
+            if isinstance(variant, list):
+                variant = variant[0]
+            if isinstance(variant.model, str):
+                if resolve_key(variant.model) == "minecraft:block/air":
+                    continue
+                model = self.get_parsed_model(variant.model)
+                tints = self.get_tints(variant.model, palleted)
+            else:
+                model = variant.model.bake()
+                tints = []
+            color = self.get_model_average_color(model, tints)
+            if color is not None:
+                break
+        self.average_colors[state] = color
+        return color
+
+    def get_model_average_color(
+        self, model: MinecraftModel, tints: list[TintSource]
+    ) -> Optional[tuple[float, float, float, float]]:
+        total = np.zeros(3)
+        alpha = 0.0
+        count = 0
+        for value, _ in self.load_textures(model).values():
+            if isinstance(value, tuple):
+                if len(value) == 0:
+                    continue
+                value = value[0][0]
+            pixels = np.asarray(value.convert("RGBA"), dtype=np.float64)
+            pixels = pixels.reshape(-1, 4) / 255
+            total += (pixels[:, :3] * pixels[:, 3:]).sum(axis=0)
+            alpha += pixels[:, 3].sum()
+            count += len(pixels)
+        if alpha == 0:
+            return None
+        r, g, b = total / alpha
+        tinted = any(
+            face.tintindex >= 0
+            for element in model.elements
+            for face in element.faces.values()
         )
+        if tinted and len(tints) > 0:
+            tint = tints[0].resolve(self.getter, item=self.item)
+            r, g, b = r * tint[0] / 255, g * tint[1] / 255, b * tint[2] / 255
+        return (r, g, b, alpha / count)
+
+    def render_level_of_detail(self, center: tuple[float, float, float]):
+        """
+        Draws each block as a single colored box, using average texture colors.
+        In "voxel" mode faces hidden by an opaque neighbour are skipped,
+        in "heightmap" mode only the top block of each column is drawn.
+        """
+        structure = self.structure
+        palette_colors = np.zeros((len(structure.palette), 4), dtype=np.float32)
+        for state in structure.unique_states():
+            if color := self.get_average_color(state):
+                palette_colors[state] = color
+        colors = palette_colors[structure.states]
+        visible = colors[:, 3] > 0
+        positions = structure.positions[visible].astype(np.int32)
+        colors = colors[visible]
+        if len(positions) == 0:
+            return
 
-        model = (
-            self.get_parsed_model(resolved_variant.model)
-            if isinstance(resolved_variant.model, str)
-            else resolved_variant.model
+        if self.resolved_level_of_detail == "heightmap":
+            sx, _, sz = structure.size
+            column = positions[:, 0] * (sz + 1) + positions[:, 2]
+            order = np.lexsort((positions[:, 1], column))
+            column = column[order]
+            top = order[np.append(column[1:] != column[:-1], True)]
+            positions = positions[top]
+            colors = colors[top]
+            mins = positions.copy()
+            mins[:, 1] = 0
+            sizes = np.ones_like(mins)
+            sizes[:, 1] = positions[:, 1] + 1
+            faces = {
+                face: np.ones(len(mins), dtype=bool)
+                for face in FACE_DIRECTIONS.keys()
+                if face != "down"
+            }
+        else:
+            # faces touching an opaque voxel are never visible
+            opaque = np.zeros(
+                tuple(x + 2 for x in structure.size), dtype=bool
+            )
+            shifted = positions + 1
+            opaque[shifted[:, 0], shifted[:, 1], shifted[:, 2]] = colors[:, 3] >= 0.99
+            faces = {}
+            for face, (dx, dy, dz) in FACE_DIRECTIONS.items():
+                faces[face] = ~opaque[
+                    shifted[:, 0] + dx, shifted[:, 1] + dy, shifted[:, 2] + dz
+                ]
+            mins = positions
+            sizes = np.ones_like(mins)
+
+        # same coordinates as GenericModelRenderTask.center_element
+        origin = np.array(
+            [8 + center[i] - self.offset[i] for i in range(3)], dtype=np.float32
         )
-        model = model.bake()
-        if self.images_override:
-            textures = self.get_textures(model, self.images_override)
-            model.textures = textures
-
-        task = ModelRenderTask(
-            getter=self.getter,
-            render_size=self.render_size,
-            model=model,
-            dynamic_textures=self.dynamic_textures,
-            do_rotate_camera=False,
-            additional_rotations=rots,
-            offset=(block.pos[0] * 16, block.pos[1] * 16, block.pos[2] * 16),
-            center_offset=center,
-            tints=tints,
+        # premultiplied alpha
+        colors = colors.copy()
+        colors[:, :3] *= colors[:, 3:]
+        vertices, normals, vertex_colors = build_box_quads(
+            mins.astype(np.float32) * 16 - origin,
+            sizes.astype(np.float32) * 16,
+            colors,
+            faces,
         )
-        task.run()
+        if len(vertices) == 0:
+            return
+
+        glEnable(GL_LIGHT0)
+        glDisable(GL_LIGHT1)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, vertices)
+        glNormalPointer(GL_FLOAT, 0, normals)
+        glColorPointer(4, GL_FLOAT, 0, vertex_colors)
+        glDrawArrays(GL_QUADS, 0, len(vertices))
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisable(GL_LIGHT0)
 
     def get_tints(self, model: str, palleted) -> list[TintSource]:
         opts = self.getter._ctx.validate("model_resolver", ModelResolverOptions)
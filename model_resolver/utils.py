@@ -1,11 +1,15 @@
 import json
+import mmap
 import os
 import subprocess
-from beet import Context
+from beet import Cache, Context
 from pydantic import BaseModel
-from typing import TYPE_CHECKING, Any, Literal, Self
+from typing import TYPE_CHECKING, Any, Callable, Literal, Optional, Self, get_args, get_origin
 from beet import Context
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from functools import lru_cache
+from PIL import Image
 
 from pydantic import BaseModel
 import logging
@@ -51,7 +55,140 @@ class ModelResolverOptions(BaseModel):
     colorize_blocks: bool = True
     preferred_minecraft_generated: Literal["misode/mcmeta", "java"] = "misode/mcmeta"
     transparent_missingno: bool = True
-
+    texture_cache_size: int = 256 * 1024 * 1024  # bytes of decoded textures kept in memory
+    max_animation_ticks: int = 24000  # animations looping later are truncated
+    max_animation_frames: int = 1024
+
+
+
+@dataclass
+class DecodedTextureCache:
+    """
+    Decoded RGBA images shared by every task of a session.
+    An entry is only reused while it was decoded from the same source object, so a texture
+    overwritten in a pack is decoded again. Least recently used images are evicted once
+    they take more than `max_bytes`.
+    Cached images are shared and must not be modified in place.
+    """
+
+    max_bytes: int
+    size: int = 0
+    entries: OrderedDict[tuple[str, str], tuple[object, Image.Image]] = field(
+        default_factory=OrderedDict
+    )
+
+    def get(
+        self,
+        key: tuple[str, str],
+        source: object,
+        decode: Callable[[], Image.Image],
+    ) -> Image.Image:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is source:
+            self.entries.move_to_end(key)
+            return entry[1]
+        img = decode().convert("RGBA")
+        self.discard(key)
+        self.entries[key] = (source, img)
+        self.size += 4 * img.width * img.height
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self.discard(next(iter(self.entries)))
+        return img
+
+    def discard(self, key: tuple[str, str]):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= 4 * entry[1].width * entry[1].height
+
+
+class PackedTextureCache:
+    """
+    Raw RGBA images packed one after the other in a single file of a beet cache,
+    read back through mmap. The index lives in the cache json, and everything is
+    dropped when the fingerprint changes.
+    """
+
+    def __init__(self, cache: Cache, fingerprint: str):
+        self.path = cache.get_path("packed_textures.bin")
+        state = cache.json.get("packed_textures")
+        if not state or state.get("fingerprint") != fingerprint or not self.path.is_file():
+            state = {"fingerprint": fingerprint, "index": {}}
+            self.path.write_bytes(b"")
+            cache.json["packed_textures"] = state
+        self.index: dict[str, list[int]] = state["index"]
+        self.buffer: Optional[mmap.mmap] = None
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        if key not in self.index:
+            return None
+        offset, width, height = self.index[key]
+        end = offset + 4 * width * height
+        if self.buffer is None or len(self.buffer) < end:
+            self.close()
+            with open(self.path, "rb") as file:
+                self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return Image.frombytes("RGBA", (width, height), self.buffer[offset:end])
+
+    def put(self, key: str, img: Image.Image):
+        img = img.convert("RGBA")
+        with open(self.path, "ab") as file:
+            offset = file.seek(0, os.SEEK_END)
+            file.write(img.tobytes())
+        self.index[key] = [offset, img.width, img.height]
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+
+@dataclass
+class DiscriminatorIndex[T: BaseModel]:
+    """
+    Registered subclasses of a model family, indexed by the values of their discriminator fields.
+    Candidates are listed last registered first, so a subclass registered later
+    overrides the one it inherits from.
+    """
+
+    classes: list[type[T]]
+    fields: tuple[str, ...]
+    candidates: dict[tuple[Optional[str], ...], list[type[T]]] = field(
+        default_factory=dict
+    )
+    indexed_classes: int = 0
+
+    def get_candidates(self, data: Any) -> list[type[T]]:
+        if self.indexed_classes != len(self.classes):
+            # a subclass was registered since the last lookup
+            self.candidates = {}
+            self.indexed_classes = len(self.classes)
+        key = tuple(
+            value if isinstance(value, str) else None
+            for value in (
+                data.get(name) if isinstance(data, dict) else None
+                for name in self.fields
+            )
+        )
+        if (candidates := self.candidates.get(key)) is None:
+            candidates = [
+                cls
+                for cls in reversed(self.classes)
+                if all(self.accepts(cls, name, value) for name, value in zip(self.fields, key))
+            ]
+            self.candidates[key] = candidates
+        return candidates
+
+    @staticmethod
+    def accepts(cls: type[BaseModel], name: str, value: Optional[str]) -> bool:
+        field_info = cls.model_fields.get(name)
+        if field_info is None:
+            return True
+        if value is None and not field_info.is_required():
+            return True
+        if get_origin(field_info.annotation) is Literal:
+            return value in get_args(field_info.annotation)
+        # not a literal, only the validation can tell
+        return True
 
 
 @lru_cache
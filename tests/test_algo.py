@@ -1,5 +1,42 @@
-from model_resolver.tasks.structure import verify_when
+import io
+import json
+import pytest
+from types import SimpleNamespace
+from zipfile import ZipFile
+
+from beet import Blockstate, Cache, ItemTag, Model
+from beet import ItemModel as ItemModelFile
+from model_resolver.item_model.data_component_predicate import get_tagged_ids
+from model_resolver.item_model.item import Item
+from model_resolver.item_model.model import (
+    ItemModel,
+    ItemModelBaseClass,
+    ItemModelConditionComponent,
+    ItemModelModel,
+    ItemModelRangeDispatchCompass,
+    ItemModelRecursive,
+    apply_component_patch,
+    resolve_item_model,
+)
+from model_resolver.item_model.special import SpecialModel, SpecialModelBell
+from model_resolver.pack_getter import JarNamespaceProxy, PackGetterNamespaceProxy, get_by_lookup_order
+from model_resolver.minecraft_model import MinecraftModel
+from model_resolver.render import DynamicTextures, Render
+from model_resolver.tasks.item import ItemRenderTask, ItemVariantsRenderTask
+from model_resolver.tasks.model import ModelRenderTask
+from model_resolver.tasks.base import Task, share_render, share_renders
+from model_resolver.tasks.generic_render import Animation, TickGrouped
+from model_resolver.utils import DecodedTextureCache, ModelResolverOptions, PackedTextureCache
+from model_resolver.tasks.structure import (
+    VariantModel,
+    choose_variant,
+    compile_when,
+    get_position_seed,
+    positional_random,
+    verify_when,
+)
 from nbtlib import Compound, String
+from PIL import Image
 
 
 def test_when_condition():
@@ -51,3 +88,502 @@ def test_when_condition():
         )
         == False
     )
+
+
+def test_compiled_when_condition():
+    predicate = compile_when(
+        {
+            "OR": [
+                {"north": "side|up", "east": "none"},
+                {"AND": [{"south": "up"}, {"west": "side"}]},
+            ]
+        }
+    )
+
+    assert predicate({"north": "up", "east": "none"}) == True
+    assert predicate({"north": "side", "east": "side"}) == False
+    assert predicate({"south": "up", "west": "side"}) == True
+    assert predicate({"south": "up"}) == False
+    assert predicate({}) == False
+
+    assert compile_when({"power": "0|15"})({"power": 15}) == True
+
+
+def test_positional_variant_selection():
+    variants = [
+        VariantModel(model="block/stone", weight=0),
+        VariantModel(model="block/mossy", weight=3),
+        VariantModel(model="block/cracked", weight=1),
+    ]
+    picked = set()
+    for x in range(16):
+        for z in range(16):
+            value = positional_random(143221, (x, 64, z), 3)
+            assert 0 <= value < 1
+            assert value == positional_random(143221, (x, 64, z), 3)
+            picked.add(choose_variant(variants, value).model)
+
+    assert picked == {"block/mossy", "block/cracked"}
+    assert positional_random(1, (0, 0, 0), 0) != positional_random(2, (0, 0, 0), 0)
+
+
+
+def test_position_seed_wraps_x_as_an_int():
+    # Java multiplies x as an int: x and x + 2**32 get the same seed
+    assert get_position_seed(1000, 64, -5) == get_position_seed(1000 + (1 << 32), 64, -5)
+    assert get_position_seed(1000, 64, -5) != get_position_seed(1001, 64, -5)
+
+
+def test_lookup_merge_leaves_packs_untouched():
+    custom = Blockstate({"multipart": [{"apply": {"model": "custom:block/a"}}]})
+    vanilla = Blockstate(
+        {
+            "variants": {"": {"model": "minecraft:block/a"}},
+            "multipart": [{"apply": {"model": "minecraft:block/b"}}],
+        }
+    )
+    lookups = [{"minecraft:a": custom}, {"minecraft:a": vanilla}]
+
+    first = get_by_lookup_order(lookups, "minecraft:a")  # type: ignore
+    second = get_by_lookup_order(lookups, "minecraft:a")  # type: ignore
+
+    assert first.data == second.data
+    assert len(first.data["multipart"]) == 2
+    assert first.data["variants"] == {"": {"model": "minecraft:block/a"}}
+    assert len(vanilla.data["multipart"]) == 1
+    assert "variants" not in custom.data
+
+
+def test_lookup_remembers_missing_keys():
+    context: dict[str, Blockstate] = {}
+    proxy = PackGetterNamespaceProxy([context])  # type: ignore
+
+    assert "minecraft:a" not in proxy
+    assert proxy.missing == {"minecraft:a"}
+
+    context["minecraft:a"] = Blockstate({"variants": {}})
+    assert "minecraft:a" not in proxy
+
+    proxy.missing.discard("minecraft:a")
+    assert proxy["minecraft:a"] is context["minecraft:a"]
+
+
+def test_jar_lookup_reads_single_members():
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as jar:
+        jar.writestr("assets/minecraft/models/block/stone.json", '{"parent": "block/cube_all"}')
+        jar.writestr("assets/minecraft/textures/block/stone.png", b"")
+    jar = ZipFile(buffer)
+    models = JarNamespaceProxy(lambda: jar, Model, "assets")
+
+    assert list(models) == ["minecraft:block/stone"]
+    assert models["minecraft:block/stone"].data == {"parent": "block/cube_all"}
+    assert models["minecraft:block/stone"] is models["minecraft:block/stone"]
+    assert models.get("minecraft:block/dirt") is None
+
+
+def test_decoded_texture_cache():
+    cache = DecodedTextureCache(max_bytes=2 * 16 * 16 * 4)
+    first, second, third = object(), object(), object()
+
+    stone = cache.get(("texture", "stone"), first, lambda: Image.new("P", (16, 16)))
+    assert stone.mode == "RGBA"
+    assert cache.get(("texture", "stone"), first, lambda: Image.new("RGBA", (1, 1))) is stone
+    assert cache.get(("texture", "stone"), second, lambda: Image.new("RGBA", (16, 16))) is not stone
+
+    cache.get(("texture", "dirt"), first, lambda: Image.new("RGBA", (16, 16)))
+    cache.get(("texture", "sand"), third, lambda: Image.new("RGBA", (16, 16)))
+    assert list(cache.entries) == [("texture", "dirt"), ("texture", "sand")]
+    assert cache.size == 2 * 16 * 16 * 4
+
+
+def test_apply_palette():
+    palette = Image.new("RGB", (2, 2))
+    # rows are filled first: (10, 10, 10) is both at (1, 0) and (0, 1)
+    palette.putdata([(20, 20, 20), (10, 10, 10), (10, 10, 10), (30, 30, 30)])
+    color_palette = Image.new("RGB", (2, 2))
+    color_palette.putdata([(255, 0, 0), (0, 255, 0), (0, 0, 255), (9, 9, 9)])
+    texture = Image.new("RGBA", (3, 1))
+    texture.putdata([(10, 10, 10, 128), (20, 20, 20, 255), (40, 40, 40, 64)])
+
+    result = Render.apply_palette(texture, palette, color_palette)
+
+    # the first column wins: (0, 1) and not (1, 0)
+    assert list(result.getdata()) == [(0, 0, 255, 128), (255, 0, 0, 255), (40, 40, 40, 64)]
+
+
+def test_dynamic_textures_are_generated_on_demand():
+    calls: list[str] = []
+
+    def generate() -> Image.Image:
+        calls.append("trims/items/helmet_trim_gold")
+        return Image.new("RGBA", (16, 16))
+
+    textures = DynamicTextures()
+    textures.add_source("minecraft:trims/items/helmet_trim_gold", generate)
+    assert calls == []
+
+    assert "minecraft:trims/items/helmet_trim_gold" in textures
+    assert textures.get("minecraft:trims/items/helmet_trim_iron") is None
+    img = textures["minecraft:trims/items/helmet_trim_gold"]
+    assert textures["minecraft:trims/items/helmet_trim_gold"] is img
+    assert calls == ["trims/items/helmet_trim_gold"]
+
+
+def test_packed_texture_cache(tmp_path):
+    cache = Cache(tmp_path)
+    red = Image.new("RGBA", (2, 3), (255, 0, 0, 128))
+    blue = Image.new("RGB", (4, 4), (0, 0, 255))
+
+    packed = PackedTextureCache(cache, "first")
+    assert packed.get("minecraft:red") is None
+    packed.put("minecraft:red", red)
+    assert packed.get("minecraft:red").tobytes() == red.tobytes()  # type: ignore
+    packed.put("minecraft:blue", blue)
+    assert packed.get("minecraft:blue").tobytes() == blue.convert("RGBA").tobytes()  # type: ignore
+    packed.close()
+
+    assert PackedTextureCache(cache, "first").get("minecraft:red") is not None
+    assert PackedTextureCache(cache, "second").get("minecraft:red") is None
+
+
+def test_blend_images():
+    first = Image.new("RGBA", (2, 2), (0, 100, 255, 255))
+    second = Image.new("RGBA", (2, 2), (255, 0, 0, 0))
+
+    blended = Animation.blend_images(first, second, 1 / 3)
+
+    # int(a * (1 - t) + b * t) truncates
+    assert blended.getpixel((1, 1)) == (85, 66, 170, 170)
+    assert Animation.blend_images(first, second, 0).tobytes() == first.tobytes()
+
+
+def test_animation_frames_share_renders():
+    water = Image.new("RGBA", (16, 16), (0, 0, 255, 128))
+    lava = Image.new("RGBA", (16, 16), (255, 128, 0, 255))
+    frames = [
+        ({"water": water}, {"minecraft:fire": (0, 2.0)}),
+        ({"water": lava}, {"minecraft:fire": (0, 2.0)}),
+        ({"water": water.copy()}, {"minecraft:fire": (1, 2.0)}),
+        ({"water": water.copy()}, {"minecraft:fire": (0, 2.0)}),
+    ]
+
+    renders = {}
+    tasks = [
+        share_render(Task(getter=None), Animation.frame_key(images, indices), renders)  # type: ignore
+        for images, indices in frames
+    ]
+
+    assert tasks[0].shared_render is None
+    assert tasks[1].shared_render is None
+    assert tasks[2].shared_render is None
+    assert tasks[3].shared_render is tasks[0]
+    assert tasks[0].pending_shares == 1
+
+
+def test_identical_tasks_share_renders():
+    class KeyedTask(Task):
+        def get_render_key(self):
+            return self.path_ctx
+
+    # the third one is a frame of the second one's animation
+    tasks = [KeyedTask(getter=None, path_ctx=key) for key in ("a", "a", "a", "b", "a")]  # type: ignore
+    tasks.append(Task(getter=None))  # type: ignore
+    share_render(tasks[2], "frame", {"frame": tasks[1]})
+
+    assert share_renders(tasks) == 2
+    assert [task.shared_render for task in tasks] == [None, tasks[0], tasks[0], None, tasks[0], None]
+    assert tasks[0].pending_shares == 3
+    assert tasks[1].pending_shares == 0
+
+
+def test_animation_selects_frames_without_cropping():
+    strip = Image.new("RGBA", (2, 6), (0, 0, 0, 255))
+    strip.paste((255, 255, 255, 255), (0, 2, 2, 4))
+    getter = SimpleNamespace(
+        get_image=lambda path: strip,
+        decoded_textures=DecodedTextureCache(max_bytes=1024),
+    )
+    animation = Animation(textures=[], getter=getter, animation_framerate=20)  # type: ignore
+    ticks = [TickGrouped(tick={"minecraft:block/a": i}, duration=1) for i in range(3)]
+    for i, tick in enumerate(ticks):
+        tick.tick_before = ticks[(i - 1) % 3]
+        tick.tick_after = ticks[(i + 1) % 3]
+
+    images, frames = animation.get_images(ticks[1], {"minecraft:block/a": ([0, 1, 2], False)})
+    assert images == {}
+    assert frames == {"minecraft:block/a": (1, 3.0)}
+
+    # a frame shown for two ticks is blended with the next one on its second tick
+    ticks[1].tick_before = TickGrouped(tick={"minecraft:block/a": 1}, duration=1, tick_before=ticks[0])
+    images, frames = animation.get_images(ticks[1], {"minecraft:block/a": ([0, 1, 1, 2], True)})
+    assert frames == {}
+    assert images["minecraft:block/a"].getpixel((0, 0)) == (127, 127, 127, 255)
+
+
+def test_animation_period_is_bounded():
+    texture_animated = {"a": ([0, 0, 1], False), "b": ([0, 1], False)}
+
+    def tick_durations(**options) -> list[int]:
+        getter = SimpleNamespace(opts=ModelResolverOptions(**options))
+        animation = Animation(textures=[], getter=getter, animation_framerate=20)  # type: ignore
+        return [tick.duration for tick in animation.get_tick_grouped(texture_animated)]
+
+    assert tick_durations() == [1] * 6
+    assert tick_durations(max_animation_ticks=4) == [1] * 4
+    assert tick_durations(max_animation_frames=3) == [1] * 3
+
+
+def test_item_model_dispatch():
+    compass = {"type": "minecraft:range_dispatch", "property": "compass", "target": "spawn"}
+
+    assert isinstance(ItemModelRecursive({"type": "model", "model": "minecraft:item/stone"}).model, ItemModelModel)
+    assert type(ItemModelRecursive(compass).model) is ItemModelRangeDispatchCompass
+
+    class OverriddenCompass(ItemModelRangeDispatchCompass):
+        pass
+
+    try:
+        # subclasses registered later take precedence
+        assert type(ItemModelRecursive(compass).model) is OverriddenCompass
+    finally:
+        ItemModelBaseClass.remove(OverriddenCompass)
+    assert type(ItemModelRecursive(compass).model) is ItemModelRangeDispatchCompass
+
+
+def test_special_model_dispatch():
+    assert type(SpecialModel({"type": "minecraft:bell"}).special_model) is SpecialModelBell
+    with pytest.raises(ValueError):
+        SpecialModel({"type": "minecraft:unknown"}).special_model
+
+
+def test_item_model_leaves_are_memoized_by_read_components():
+    item_model = ItemModelFile({
+        "model": {
+            "type": "minecraft:condition",
+            "property": "minecraft:has_component",
+            "component": "minecraft:glider",
+            "on_true": {"type": "minecraft:model", "model": "test:glider"},
+            "on_false": {"type": "minecraft:model", "model": "test:plain"},
+        }
+    })
+    getter = SimpleNamespace(
+        assets=SimpleNamespace(
+            item_models={"test:item": item_model},
+            models={
+                "test:glider": Model({"textures": {"layer0": "test:glider"}}),
+                "test:plain": Model({"textures": {"layer0": "test:plain"}}),
+            },
+        ),
+        parsed_item_models={},
+        resolved_item_models={},
+    )
+
+    def resolve(**components):
+        leaves = resolve_item_model(getter, "test:item", Item(id="test:item", components=components))  # type: ignore
+        assert leaves is not None
+        return leaves
+
+    glider = resolve(**{"minecraft:glider": {}, "minecraft:custom_name": "a"})
+    assert glider[0][0].textures["layer0"] == "test:glider"
+    # the custom name is not read by the item model
+    assert resolve(**{"minecraft:glider": {}, "minecraft:custom_name": "b"}) is glider
+    assert resolve(**{"minecraft:custom_name": "a"})[0][0].textures["layer0"] == "test:plain"
+    assert resolve_item_model(getter, "test:missing", Item(id="test:item")) is None  # type: ignore
+
+
+def test_item_model_variants():
+    item_model = ItemModel.model_validate({
+        "model": {
+            "type": "minecraft:select",
+            "property": "minecraft:custom_model_data",
+            "index": 1,
+            "cases": [
+                {"when": ["red", "crimson"], "model": {"type": "minecraft:model", "model": "test:red"}},
+                {
+                    "when": "blue",
+                    "model": {
+                        "type": "minecraft:condition",
+                        "property": "minecraft:has_component",
+                        "component": "minecraft:glider",
+                        "on_true": {"type": "minecraft:model", "model": "test:glider"},
+                        "on_false": {"type": "minecraft:model", "model": "test:blue"},
+                    },
+                },
+            ],
+            "fallback": {"type": "minecraft:model", "model": "test:plain"},
+        }
+    })
+    patches = list(item_model.iter_patches())
+    assert [apply_component_patch({}, patch) for patch in patches] == [
+        {"minecraft:custom_model_data": {"strings": ["", "red"]}},
+        {"minecraft:custom_model_data": {"strings": ["", "crimson"]}},
+        {"minecraft:custom_model_data": {"strings": ["", "blue"]}, "minecraft:glider": {}},
+        {"minecraft:custom_model_data": {"strings": ["", "blue"]}},
+        {},
+    ]
+    components = {"minecraft:custom_model_data": {"strings": ["a"], "flags": [True]}}
+    assert apply_component_patch(components, patches[0]) == {
+        "minecraft:custom_model_data": {"strings": ["a", "red"], "flags": [True]}
+    }
+    assert components["minecraft:custom_model_data"]["strings"] == ["a"]
+
+
+def test_component_condition_is_compiled_once():
+    condition = ItemModelRecursive.model_validate({
+        "type": "minecraft:condition",
+        "property": "minecraft:component",
+        "predicate": "minecraft:damage",
+        "value": {"damage": {"min": 1, "max": 10}, "durability": {"min": 10, "max": 19}},
+        "on_true": {"type": "minecraft:model", "model": "test:damaged"},
+        "on_false": {"type": "minecraft:model", "model": "test:intact"},
+    }).model
+    assert isinstance(condition, ItemModelConditionComponent)
+    predicate = condition.compiled_predicate
+
+    def damaged(damage: int) -> bool:
+        item = Item(id="test:item", components={"minecraft:max_damage": 20, "minecraft:damage": damage})
+        return condition.resolve_condition(None, item)  # type: ignore
+
+    assert damaged(5)
+    assert not damaged(0)
+    assert not damaged(15)
+    assert condition.compiled_predicate is predicate
+
+
+def test_tags_are_flattened_once():
+    tags = {
+        "test:fruits": ItemTag({"values": ["#test:berries", "minecraft:apple"]}),
+        "test:berries": ItemTag({"values": ["minecraft:sweet_berries"]}),
+    }
+    getter = SimpleNamespace(data=SimpleNamespace(item_tags=tags), tag_index={})
+    fruits = {"minecraft:apple", "minecraft:sweet_berries"}
+
+    assert get_tagged_ids("#test:fruits", getter, "item_tags") == fruits  # type: ignore
+    assert get_tagged_ids(["#test:berries", "carrot"], getter, "item_tags") == {"minecraft:sweet_berries", "minecraft:carrot"}  # type: ignore
+    tags["test:berries"].data["values"].append("minecraft:glow_berries")
+    assert get_tagged_ids("#test:fruits", getter, "item_tags") == fruits  # type: ignore
+    getter.tag_index.clear()
+    assert get_tagged_ids("#test:fruits", getter, "item_tags") == fruits | {"minecraft:glow_berries"}  # type: ignore
+    with pytest.raises(ValueError):
+        get_tagged_ids("#test:fruits")
+
+
+def test_item_components_are_merged_once():
+    item = Item(id="minecraft:stick", components={"minecraft:custom_name": "a"})
+    item.default_components = {"minecraft:max_stack_size": 64, "minecraft:custom_name": "stick"}
+    components = item.components
+    assert components == {"minecraft:max_stack_size": 64, "minecraft:custom_name": "a"}
+    assert item.components is components
+    with pytest.raises(TypeError):
+        components["minecraft:custom_name"] = "b"  # type: ignore
+
+    fingerprint = item.components_fingerprint
+    same = Item(id="minecraft:stick", components={"minecraft:custom_name": "a"})
+    same.default_components = {"minecraft:custom_name": "stick", "minecraft:max_stack_size": 64}
+    assert same.components_fingerprint == fingerprint
+
+    item.components_from_user = {"minecraft:custom_name": "b"}
+    assert item.components["minecraft:custom_name"] == "b"
+    assert item.components_fingerprint != fingerprint
+
+
+def test_item_components_cannot_go_stale():
+    item = Item(id="minecraft:stick", components={"minecraft:custom_name": "a"})
+    fingerprint = item.components_fingerprint
+    with pytest.raises(TypeError):
+        item.components_from_user["minecraft:custom_model_data"] = {"floats": [1.0]}
+    with pytest.raises(TypeError):
+        item.default_components.update({"minecraft:max_stack_size": 1})
+    assert "minecraft:custom_model_data" not in item.components
+    assert item.components_fingerprint == fingerprint
+
+    # dicts assigned without validation are frozen as well
+    item.components_from_user = {"minecraft:custom_model_data": {"floats": [1.0]}}
+    assert item.components["minecraft:custom_model_data"] == {"floats": [1.0]}
+    assert item.components_fingerprint != fingerprint
+    with pytest.raises(TypeError):
+        item.components_from_user.pop("minecraft:custom_model_data")
+
+
+def test_model_render_task_bakes_once():
+    model = MinecraftModel.model_validate({"parent": "minecraft:builtin/generated", "textures": {"layer0": "test:stick"}})
+    task = ModelRenderTask(getter=None, model=model)  # type: ignore
+    baked = task.get_baked_model()
+    assert task.get_baked_model() is baked
+    assert len(baked.elements) == 1
+    task.flush()
+    assert task.baked_model is None
+
+
+def test_item_variants_share_renders(tmp_path):
+    item_model = ItemModelFile({
+        "model": {
+            "type": "minecraft:condition",
+            "property": "minecraft:has_component",
+            "component": "minecraft:glider",
+            "on_true": {"type": "minecraft:model", "model": "test:plain"},
+            "on_false": {"type": "minecraft:model", "model": "test:plain"},
+        }
+    })
+    getter = SimpleNamespace(
+        assets=SimpleNamespace(
+            item_models={"test:item": item_model},
+            models={"test:plain": Model({"textures": {"layer0": "test:plain"}})},
+            textures={},
+        ),
+        parsed_item_models={},
+        resolved_item_models={},
+    )
+    item = Item(id="test:item", components={"minecraft:item_model": "test:item"})
+    item.__resolved__ = True
+    task = ItemVariantsRenderTask(getter=getter, item=item, path_save=tmp_path)  # type: ignore
+
+    tasks = list(task.resolve())
+
+    assert len(tasks) == 1
+    assert isinstance(tasks[0], ItemRenderTask)
+    assert tasks[0].path_save == tmp_path / "0.png"
+    assert task.manifest == [
+        {"components": {"minecraft:glider": {}}, "render": "0.png"},
+        {"components": {}, "render": "0.png"},
+    ]
+    assert json.loads((tmp_path / "manifest.json").read_text()) == task.manifest
+
+    # animated renders are a directory of frames or a webp file
+    assert task.get_render_path("1", is_animated=True) == "1/"
+    task.animation_mode = "webp"
+    assert task.get_render_path("1", is_animated=True) == "1.webp"
+    assert task.get_render_path("1", is_animated=False) == "1.png"
+
+
+def test_component_condition_variants(caplog):
+    def condition(predicate, value, on_true, on_false):
+        return {
+            "type": "minecraft:condition",
+            "property": "minecraft:component",
+            "predicate": predicate,
+            "value": value,
+            "on_true": on_true,
+            "on_false": on_false,
+        }
+
+    item_model = ItemModel.model_validate({
+        "model": condition(
+            "minecraft:damage",
+            {"damage": {"min": 1, "max": 10}, "durability": {"min": 10, "max": 19}},
+            {"type": "minecraft:model", "model": "test:damaged"},
+            condition(
+                "minecraft:enchantments",
+                [{"enchantments": "#minecraft:curse", "levels": 1}],
+                {"type": "minecraft:model", "model": "test:cursed"},
+                {"type": "minecraft:model", "model": "test:intact"},
+            ),
+        )
+    })
+
+    patches = [apply_component_patch({}, patch) for patch in item_model.iter_patches()]
+
+    assert patches == [{"minecraft:damage": 1, "minecraft:max_damage": 11}, {}]
+    # tags need the packs, the cursed branch can't be reached
+    assert "skipping its on_true branch" in caplog.text